@@ -0,0 +1,359 @@
+import argparse
+import asyncio
+import contextlib
+import importlib
+import io
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import cloudflareAuto_change_ip as monitor_module
+
+# شبیه‌سازی کامل بدون سرور ایران و بدون حساب کلودفلر:
+# Cloudflare و Telegram جعلی روی loopback، سرورهای جعلی روی 127.0.0.x و قطعی‌ها طبق سناریو
+ZONE_ID = 'bench-zone'
+BACKEND_IPS = ['127.0.0.11', '127.0.0.12', '127.0.0.13', '127.0.0.14']
+SCENARIO = [  # (seconds after start, backend index, action)
+    (2.0, 0, 'down'),
+    (6.0, 0, 'up'),
+]
+SCENARIO_DURATION = 12
+# فاصله‌های زمانی کوچک شده تا هر اجرا چند ثانیه طول بکشد
+BENCH_SETTINGS = {
+    'PING_METHOD': 'tcp',  # ICMP روی loopback همیشه جواب می‌دهد، پس RTT از زمان اتصال TCP گرفته می‌شود
+    'TCP_TIMEOUT': 1,
+    'PROBE_DEADLINE': 1,
+    'PROBE_INTERVAL_MIN': 0.5,
+    'PROBE_INTERVAL_MAX': 2,
+    'FAILOVER_DEADLINE': 1,
+    'PROBE_BATCH_WINDOW': 0.1,
+    'NOTIFY_COALESCE_WINDOW': 0.2,
+    'HTTP_BACKOFF_MAX': 1,
+    'DNS_HOLD_TIME': 1,
+    'METRICS_ADDRESS': None,
+}
+
+
+def create_fake_cloudflare(record_count, latency, rate_limit_every):
+    records = {}
+    for i in range(record_count):
+        record_id = f"rec{i:05d}"
+        records[record_id] = {'id': record_id, 'type': 'A', 'name': f"node{i}.bench.test",
+                              'content': BACKEND_IPS[i % len(BACKEND_IPS)]}
+    return {
+        'records': records,
+        'version': 1,
+        'next_id': record_count,
+        'changes': [],  # (time, record_id, content or None when deleted)
+        'calls': Counter(),  # (method, endpoint) -> count
+        'throttled': 0,
+        'latency': latency,
+        'rate_limit_every': rate_limit_every,
+        'lock': threading.Lock(),
+    }
+
+
+def apply_record_change(cloudflare, record_id, content):
+    record = cloudflare['records'].get(record_id)
+    if record is None:
+        return None
+    if record['content'] != content:
+        record['content'] = content
+        cloudflare['version'] += 1
+        cloudflare['changes'].append((time.monotonic(), record_id, content))
+    return dict(record)
+
+
+def create_record(cloudflare, post):
+    record_id = f"rec{cloudflare['next_id']:05d}"
+    cloudflare['next_id'] += 1
+    record = {'id': record_id, 'type': post.get('type', 'A'), 'name': post['name'], 'content': post['content'],
+              'ttl': post.get('ttl', 1), 'proxied': post.get('proxied', False)}
+    cloudflare['records'][record_id] = record
+    cloudflare['version'] += 1
+    cloudflare['changes'].append((time.monotonic(), record_id, record['content']))
+    return dict(record)
+
+
+def delete_record(cloudflare, record_id):
+    record = cloudflare['records'].pop(record_id)
+    cloudflare['version'] += 1
+    cloudflare['changes'].append((time.monotonic(), record_id, None))
+    return {'id': record_id, 'name': record['name']}
+
+
+def make_cloudflare_handler(cloudflare):
+    class CloudflareHandler(BaseHTTPRequestHandler):
+        def handle_request(self):
+            url = urlsplit(self.path)
+            parts = url.path.strip('/').split('/')  # client/v4/zones/<zone>/dns_records[/<id>|/batch]
+            endpoint = '/' + '/'.join(part if i % 2 == 0 or part == 'batch' else ':id' for i, part in enumerate(parts[2:]))
+            time.sleep(cloudflare['latency'])
+            with cloudflare['lock']:
+                cloudflare['calls'][(self.command, endpoint)] += 1
+                total = sum(cloudflare['calls'].values())
+                if cloudflare['rate_limit_every'] and total % cloudflare['rate_limit_every'] == 0:
+                    cloudflare['throttled'] += 1
+                    self.send_json(429, {'success': False, 'errors': [{'code': 971, 'message': 'Please wait and consider throttling your request speed'}]},
+                                   {'Retry-After': '0.1'})
+                    return
+                if len(parts) < 5 or parts[2] != 'zones' or parts[3] != ZONE_ID or parts[4] != 'dns_records':
+                    self.send_json(404, {'success': False})
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else {}
+
+                if self.command == 'GET' and len(parts) == 5:
+                    etag = f'"{cloudflare["version"]}"'
+                    if self.headers.get('If-None-Match') == etag:
+                        self.send_json(304, None, {'ETag': etag})
+                        return
+                    query = parse_qs(url.query)
+                    page = int(query.get('page', ['1'])[0])
+                    per_page = int(query.get('per_page', ['100'])[0])
+                    ordered = [cloudflare['records'][record_id] for record_id in sorted(cloudflare['records'])]
+                    total_pages = max(1, -(-len(ordered) // per_page))
+                    result = ordered[(page - 1) * per_page:page * per_page]
+                    self.send_json(200, {'success': True, 'result': result,
+                                         'result_info': {'page': page, 'per_page': per_page, 'total_pages': total_pages, 'total_count': len(ordered)}},
+                                   {'ETag': etag})
+                elif self.command == 'POST' and parts[5:] == ['batch']:
+                    # like Cloudflare: one transaction, applied as deletes, patches, posts
+                    ids = [item['id'] for item in body.get('deletes', []) + body.get('patches', [])]
+                    if any(record_id not in cloudflare['records'] for record_id in ids):
+                        self.send_json(400, {'success': False, 'errors': [{'code': 81044, 'message': 'Record does not exist.'}]})
+                        return
+                    deleted = [delete_record(cloudflare, item['id']) for item in body.get('deletes', [])]
+                    patched = [apply_record_change(cloudflare, patch['id'], patch['content']) for patch in body.get('patches', [])]
+                    posted = [create_record(cloudflare, post) for post in body.get('posts', [])]
+                    self.send_json(200, {'success': True, 'result': {'deletes': deleted, 'patches': patched, 'posts': posted}})
+                elif self.command == 'POST' and len(parts) == 5:
+                    self.send_json(200, {'success': True, 'result': create_record(cloudflare, body)})
+                elif self.command == 'DELETE' and len(parts) == 6:
+                    if parts[5] not in cloudflare['records']:
+                        self.send_json(404, {'success': False})
+                        return
+                    self.send_json(200, {'success': True, 'result': delete_record(cloudflare, parts[5])})
+                elif self.command in ('PUT', 'PATCH') and len(parts) == 6:
+                    record = apply_record_change(cloudflare, parts[5], body['content'])
+                    if record is None:
+                        self.send_json(404, {'success': False})
+                        return
+                    self.send_json(200, {'success': True, 'result': record})
+                else:
+                    self.send_json(405, {'success': False})
+
+        def send_json(self, status, body, headers=None):
+            data = b'' if body is None else json.dumps(body).encode()
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            if body is not None:
+                self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_request
+
+        def log_message(self, format, *args):
+            pass
+
+    return CloudflareHandler
+
+
+def make_telegram_handler(telegram):
+    class TelegramHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            self.rfile.read(length)
+            with telegram['lock']:
+                telegram['messages'] += 1
+            data = json.dumps({'ok': True, 'result': {'message_id': telegram['messages']}}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return TelegramHandler
+
+
+def start_server(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_backend(backend):
+    # هر سرور جعلی فقط اتصال را قبول کرده و می‌بندد؛ بعد از قطعی روی همان پورت دوباره باز می‌شود
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((backend['ip'], backend['port']))
+    sock.listen(128)
+    backend['port'] = sock.getsockname()[1]
+    backend['socket'] = sock
+
+    def serve():
+        while True:
+            try:
+                connection, _ = sock.accept()
+            except OSError:
+                return
+            connection.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+
+
+def stop_backend(backend):
+    sock = backend.pop('socket', None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    sock.close()
+
+
+def histogram_mean(cf, name, labels=()):
+    histogram = cf.metrics.get(name, {}).get(labels)
+    if not histogram or not histogram['count']:
+        return None
+    return histogram['sum'] / histogram['count']
+
+
+async def play_scenario(backends, started):
+    events = {}
+    for offset, index, action in SCENARIO:
+        await asyncio.sleep(max(0, started + offset - time.monotonic()))
+        backend = backends[index]
+        if action == 'down':
+            stop_backend(backend)
+        else:
+            await asyncio.to_thread(start_backend, backend)
+        events[(index, action)] = time.monotonic()
+    return events
+
+
+async def run_scenario(cf, backends, last_status):
+    started = time.monotonic()
+    monitor_task = asyncio.create_task(cf.monitor(last_status))
+    events = await play_scenario(backends, started)
+    await asyncio.sleep(max(0, started + SCENARIO_DURATION - time.monotonic()))
+    monitor_task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await monitor_task
+    return events
+
+
+def measure_transition(cloudflare, since, until):
+    # زمان از رخداد تا آخرین تغییر رکوردها قبل از رخداد بعدی (در حالت single جابجایی IP و در حالت multi حذف یا اضافه شدن رکوردها)
+    changed = [at for at, _, _ in cloudflare['changes'] if since <= at < until]
+    return max(changed) - since if changed else None
+
+
+def run_benchmark(record_count, args):
+    cf = importlib.reload(monitor_module)  # هر اجرا با state تمیز شروع می‌شود
+    random.seed(args.seed)
+    cloudflare = create_fake_cloudflare(record_count, args.latency / 1000, args.rate_limit_every)
+    telegram = {'messages': 0, 'lock': threading.Lock()}
+    cloudflare_server = start_server(make_cloudflare_handler(cloudflare))
+    telegram_server = start_server(make_telegram_handler(telegram))
+    backends = [{'ip': ip, 'port': 0} for ip in BACKEND_IPS]
+    for backend in backends:
+        start_backend(backend)
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        for name, value in BENCH_SETTINGS.items():
+            setattr(cf, name, value)
+        cf.ZONE_IDS = [ZONE_ID]
+        cf.DNS_MODE = args.dns_mode
+        cf.ADDRESSES = [(backend['port'], backend['ip']) for backend in backends]
+        cf.CLOUDFLARE_API = f"http://127.0.0.1:{cloudflare_server.server_address[1]}/client/v4"
+        cf.TELEGRAM_API = f"http://127.0.0.1:{telegram_server.server_address[1]}"
+        cf.STATUS_FILE = os.path.join(state_dir, 'status.json')
+        cf.RECORDS_FILE = os.path.join(state_dir, 'records.json')
+        cf.PROBE_DB_FILE = os.path.join(state_dir, 'probes.db')
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            last_status = cf.read_status_file()
+            cf.read_record_index()
+            cf.open_probe_history()
+            events = asyncio.run(run_scenario(cf, backends, last_status))
+            cf.probe_store['db'].close()
+
+    for backend in backends:
+        stop_backend(backend)
+    cloudflare_server.shutdown()
+    telegram_server.shutdown()
+
+    down_at = events.get((0, 'down'))
+    up_at = events.get((0, 'up'))
+    failover = measure_transition(cloudflare, down_at, up_at or float('inf')) if down_at else None
+    cycles = cf.metrics.get('cfauto_cycle_seconds', {}).get(())
+    return {
+        'records': record_count,
+        'cycles': cycles['count'] if cycles else 0,
+        'cycle_ms': histogram_mean(cf, 'cfauto_cycle_seconds') * 1000 if cycles else None,
+        'phases_ms': {phase: histogram_mean(cf, 'cfauto_cycle_phase_seconds', (('phase', phase),)) * 1000
+                      for (_, phase), in cf.metrics.get('cfauto_cycle_phase_seconds', {})},
+        'api_calls': dict(cloudflare['calls']),
+        'throttled': cloudflare['throttled'],
+        'telegram_messages': telegram['messages'],
+        'failover_s': failover,
+        'revert_s': measure_transition(cloudflare, up_at, float('inf')) if up_at else None,
+        'log_lines': output.getvalue().count('\n'),
+    }
+
+
+def format_seconds(value):
+    return f"{value:.2f}" if value is not None else 'n/a'
+
+
+def print_report(results):
+    print(f"{'records':>8} {'cycles':>7} {'cycle ms':>9} {'CF calls':>9} {'429s':>5} {'TG msgs':>8} {'failover s':>11} {'revert s':>9}")
+    for result in results:
+        cycle_ms = f"{result['cycle_ms']:.1f}" if result['cycle_ms'] is not None else 'n/a'
+        print(f"{result['records']:>8} {result['cycles']:>7} {cycle_ms:>9} {sum(result['api_calls'].values()):>9} "
+              f"{result['throttled']:>5} {result['telegram_messages']:>8} {format_seconds(result['failover_s']):>11} {format_seconds(result['revert_s']):>9}")
+    for result in results:
+        phases = ', '.join(f"{phase} {value:.1f}" for phase, value in sorted(result['phases_ms'].items()))
+        calls = ', '.join(f"{method} {endpoint}: {count}" for (method, endpoint), count in sorted(result['api_calls'].items()))
+        print(f"\n{result['records']} records")
+        print(f"  mean phase ms: {phases}")
+        print(f"  Cloudflare calls: {calls}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated failover benchmark with fake Cloudflare, Telegram and backends")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help="number of DNS records per run")
+    parser.add_argument('--latency', type=float, default=20, help="Cloudflare API latency in ms")
+    parser.add_argument('--rate-limit-every', type=int, default=0, help="answer every Nth Cloudflare request with 429 (0 = never)")
+    parser.add_argument('--dns-mode', choices=['single', 'multi'], default='single', help="DNS_MODE of the monitor under test")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    results = [run_benchmark(size, args) for size in args.sizes]
+    if args.json:
+        print(json.dumps([dict(result, api_calls={f"{method} {endpoint}": count for (method, endpoint), count in result['api_calls'].items()})
+                          for result in results], indent=4))
+    else:
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,50 @@
 import requests
-from ping3 import ping
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+import asyncio
 import time
 import json
 import os
 import socket
+import ssl
+import select
+import struct
+import sqlite3
+import random
+import hmac
+import hashlib
+import argparse
+import heapq
+import threading
+import signal
+from urllib.parse import urlsplit
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+try:
+    import tomllib  # Python 3.11+
+except ImportError:
+    try:
+        import tomli as tomllib  # Python های قدیمی‌تر: pip install tomli
+    except ImportError:
+        tomllib = None
+try:
+    import yaml  # اختیاری: فقط برای فایل تنظیمات YAML لازم است
+except ImportError:
+    yaml = None
 # Constants
+# همه مقادیر زیر را می‌توان در CONFIG_FILE (TOML یا YAML) هم نوشت؛ تغییر فایل یا SIGHUP بدون ری‌استارت اعمال می‌شود
+CONFIG_FILE = 'config.toml'
+CONFIG_RELOAD_INTERVAL = 5  # هر چند ثانیه زمان تغییر فایل تنظیمات بررسی شود
 API_TOKEN = 'api_cloudflare'
-ZONE_ID = 'domain_zone_id'
+ZONE_IDS = [
+    'ZONE_IDS1',
+    'ZONE_IDS2'
+]
+# هر سرور می‌تواند یک probe اختیاری هم داشته باشد، مثلا:
+# (443, 'ip', {'type': 'tls', 'server_name': 'example.com', 'max_latency': 300})
+# (80, 'ip', {'type': 'http', 'path': '/health', 'status': 200, 'max_latency': 500})
+# (8080, 'ip', {'type': 'send_expect', 'send': b'PING\r\n', 'expect': b'PONG', 'max_latency': 200})
 ADDRESSES = [
     (8587, 'ip_server_iran1'),
     (8586, 'ip_server_iran2'),
@@ -19,237 +57,1682 @@ ADDRESSES = [
 TELEGRAM_TOKEN = 'token_telegram'
 CHAT_ID = 'admin_id'
 STATUS_FILE = 'status.json'
+STATUS_SCHEMA_VERSION = 3
+RECORDS_FILE = 'records.json'  # ایندکس رکوردهای DNS هر زون، کنار status.json
+PROBE_DB_FILE = 'probes.db'  # تاریخچه بررسی‌ها (SQLite در حالت WAL)
 
 MAX_ATTEMPTS = 3  # تعداد دفعات مجاز برای بررسی هر سرور (چه پینگ و چه TCP)
 
-def get_subdomains():
-    url = f"https://api.cloudflare.com/client/v4/zones/{ZONE_ID}/dns_records"
-    headers = {
+PROBE_CONCURRENCY = 20  # حداکثر تعداد بررسی‌های همزمان
+PING_TIMEOUT = 2
+TCP_TIMEOUT = 5
+PROBE_DEADLINE = 8  # سقف زمانی هر بررسی (ثانیه)
+PROBE_READ_LIMIT = 65536  # حداکثر بایت‌هایی که probe های http و send_expect می‌خوانند
+PING_METHOD = 'auto'  # 'icmp'، 'tcp' یا 'auto' (اگر سوکت ICMP مجاز نباشد زمان اتصال TCP استفاده می‌شود)
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMP_PAYLOAD = b'cloudflareAuto_change_ip'
+REVERT_SUCCESSES = 3  # تعداد بررسی‌های موفق پشت سر هم (در چرخه‌های جداگانه) برای بازگشت به آی‌پی اصلی
+HEALTH_CACHE_TTL = 60  # نتیجه بررسی هر سرور در طول یک چرخه دوباره استفاده می‌شود
+PROBE_INTERVAL_MIN = 15  # فاصله بررسی سرور سالم بلافاصله بعد از تأیید وضعیت (ثانیه)
+PROBE_INTERVAL_MAX = 120  # سرورهای پایدار با دو برابر شدن فاصله، حداکثر هر 120 ثانیه بررسی می‌شوند
+FAILOVER_DEADLINE = 10  # حداکثر زمان از شروع اولین بررسی ناموفق تا تغییر IP (ثانیه)؛ timeout هر بررسی به FAILOVER_DEADLINE / MAX_ATTEMPTS محدود می‌شود
+PROBE_JITTER = 0.1  # ±10% تا بررسی‌ها همزمان نشوند
+PROBE_BATCH_WINDOW = 1  # سرورهایی که در این بازه نوبتشان می‌رسد با هم بررسی می‌شوند
+TELEGRAM_MAX_LENGTH = 4096  # حداکثر طول هر پیام تلگرام
+NOTIFY_COALESCE_WINDOW = 5  # پیام‌هایی که در این چند ثانیه می‌رسند در یک پیام ارسال می‌شوند
+RECORD_INDEX_MAX_AGE = 600  # لیست رکوردهای هر زون حداکثر هر 10 دقیقه یک بار دوباره دریافت می‌شود
+RECORDS_PER_PAGE = 100
+DNS_BATCH_SIZE = 200  # حداکثر تعداد تغییرات در هر درخواست batch کلودفلر
+DNS_UPDATE_WORKERS = 4  # تعداد درخواست‌های همزمان وقتی batch شکست بخورد
+DNS_MODE = 'single'  # 'single': رکورد A هر ساب‌دامین در صورت قطعی به یک سرور دیگر تغییر می‌کند؛ 'multi': هر ساب‌دامین یک رکورد A برای هر سرور سالم دارد
+MULTI_IP_COUNT = None  # حداکثر تعداد IP هر ساب‌دامین در حالت multi (None = همه سرورهای سالم)
+PROBE_WINDOW_MINUTES = 30  # بازه زمانی تاریخچه که برای رتبه‌بندی سرورها استفاده می‌شود
+PROBE_RETENTION = 24 * 3600  # نمونه‌های خام یک روز نگه داشته می‌شوند
+PROBE_ROLLUP_BUCKET = 300  # نمونه‌های قدیمی‌تر در بازه‌های 5 دقیقه‌ای خلاصه می‌شوند
+PROBE_ROLLUP_RETENTION = 30 * 24 * 3600
+PROBE_COMPACT_INTERVAL = 3600
+RTT_FLOOR = 10  # ms
+BACKEND_LOAD_WEIGHT = 0.5  # هر رکورد اضافه، امتیاز سرور را 50% بدتر می‌کند
+# جلوگیری از رفت و برگشت مداوم رکوردها برای سرورهای ناپایدار (مثل route flap dampening در BGP):
+# هر بار قطع شدن سرور FLAP_PENALTY امتیاز منفی دارد که با نیمه‌عمر FLAP_HALF_LIFE کم می‌شود
+FLAP_PENALTY = 1000
+FLAP_HALF_LIFE = 900  # seconds
+FLAP_SUPPRESS_LIMIT = 2000  # بالاتر از این، سرور برای برگشت یا جایگزینی استفاده نمی‌شود
+FLAP_REUSE_LIMIT = 750  # سرور suppress شده فقط وقتی امتیازش زیر این عدد برسد دوباره استفاده می‌شود
+FLAP_MAX_SUPPRESS = 3600  # حداکثر زمان suppress بعد از آخرین قطعی (ثانیه)
+FLAP_HISTORY_MINUTES = 120  # بازه‌ای از تاریخچه بررسی‌ها که برای محاسبه امتیاز خوانده می‌شود
+DNS_HOLD_TIME = 300  # حداقل فاصله بین دو تغییر یک ساب‌دامین (ثانیه)؛ جابجایی از سرور قطع شده منتظر نمی‌ماند
+CLOUDFLARE_API = "https://api.cloudflare.com/client/v4"
+TELEGRAM_API = "https://api.telegram.org"
+HTTP_TIMEOUT = (5, 15)  # (connect, read) - هیچ درخواستی بدون timeout ارسال نمی‌شود
+HTTP_RETRIES = 4
+HTTP_BACKOFF = 1
+HTTP_BACKOFF_MAX = 30
+HTTP_POOL_SIZE = 10
+CLOUDFLARE_RATE_LIMIT = (1200, 300)  # سقف کلودفلر: 1200 درخواست در هر 5 دقیقه برای هر توکن
+TELEGRAM_RATE_LIMIT = (1, 1)
+RATE_LIMITS = {
+    'api.cloudflare.com': CLOUDFLARE_RATE_LIMIT,
+    'api.telegram.org': TELEGRAM_RATE_LIMIT,
+}
+# حالت چند سروری: چند نمونه برنامه روی سرورهای خارج مختلف نتایج بررسی را با هم به اشتراک می‌گذارند.
+# تغییر IP فقط وقتی انجام می‌شود که اکثریت نودها سرور را قطع ببینند و فقط leader در کلودفلر می‌نویسد
+CLUSTER_NODE_ID = None  # None = حالت تک‌سرور (مثل قبل)
+CLUSTER_LISTEN = ('0.0.0.0', 9870)  # UDP
+CLUSTER_PEERS = []  # [('foreign_server2', 9870), ...]
+CLUSTER_SECRET = 'cluster_secret'  # کلید HMAC مشترک بین همه نودها؛ باید عوض شود، با مقدار پیش‌فرض حالت cluster اجرا نمی‌شود
+DEFAULT_CLUSTER_SECRET = 'cluster_secret'
+CLUSTER_QUORUM = None  # None = اکثریت همه نودها
+CLUSTER_HEARTBEAT_INTERVAL = 2
+CLUSTER_PEER_TIMEOUT = 10  # نودی که این مدت پیامی نفرستاده زنده حساب نمی‌شود
+CLUSTER_RESULT_MAX_AGE = 2 * PROBE_INTERVAL_MAX  # نتیجه‌های قدیمی‌تر در رأی‌گیری حساب نمی‌شوند
+# این تنظیمات فقط هنگام شروع برنامه خوانده می‌شوند
+RESTART_ONLY_KEYS = {
+    'STATUS_FILE', 'RECORDS_FILE', 'PROBE_DB_FILE', 'METRICS_ADDRESS',
+    'CLUSTER_NODE_ID', 'CLUSTER_LISTEN', 'CLUSTER_PEERS', 'CLUSTER_SECRET',
+}
+CONFIG_KEYS = RESTART_ONLY_KEYS | {
+    'API_TOKEN', 'ZONE_IDS', 'ADDRESSES', 'TELEGRAM_TOKEN', 'CHAT_ID',
+    'MAX_ATTEMPTS', 'REVERT_SUCCESSES', 'PROBE_CONCURRENCY', 'PING_TIMEOUT', 'TCP_TIMEOUT', 'PROBE_DEADLINE', 'PING_METHOD',
+    'PROBE_INTERVAL_MIN', 'PROBE_INTERVAL_MAX', 'FAILOVER_DEADLINE', 'PROBE_JITTER', 'PROBE_BATCH_WINDOW',
+    'NOTIFY_COALESCE_WINDOW', 'RECORD_INDEX_MAX_AGE', 'DNS_BATCH_SIZE', 'DNS_UPDATE_WORKERS', 'DNS_MODE', 'MULTI_IP_COUNT',
+    'RTT_FLOOR', 'BACKEND_LOAD_WEIGHT', 'CLUSTER_QUORUM', 'CLUSTER_RESULT_MAX_AGE',
+    'FLAP_PENALTY', 'FLAP_HALF_LIFE', 'FLAP_SUPPRESS_LIMIT', 'FLAP_REUSE_LIMIT', 'FLAP_MAX_SUPPRESS', 'FLAP_HISTORY_MINUTES', 'DNS_HOLD_TIME',
+}
+METRICS_ADDRESS = ('127.0.0.1', 9108)  # endpoint متریک‌های Prometheus در /metrics؛ None برای غیرفعال کردن
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+METRIC_TYPES = {
+    'cfauto_probe_rtt_seconds': ('histogram', 'ICMP round-trip time per backend'),
+    'cfauto_ping_checks_total': ('counter', 'Ping checks per backend and result'),
+    'cfauto_tcp_checks_total': ('counter', 'Service checks (TCP, TLS, HTTP or send/expect) per backend and result'),
+    'cfauto_service_probe_seconds': ('histogram', 'Service check latency per backend'),
+    'cfauto_ip_changes_total': ('counter', 'Applied DNS failovers and reverts per zone'),
+    'cfauto_cloudflare_request_seconds': ('histogram', 'Cloudflare API latency per endpoint'),
+    'cfauto_cloudflare_errors_total': ('counter', 'Failed Cloudflare API requests per endpoint and status'),
+    'cfauto_telegram_messages_total': ('counter', 'Telegram messages per result'),
+    'cfauto_telegram_queue_depth': ('gauge', 'Notifications waiting to be sent'),
+    'cfauto_cycle_phase_seconds': ('histogram', 'Time spent in each phase of a probe round'),
+    'cfauto_cycle_seconds': ('histogram', 'Total time of a probe round'),
+    'cfauto_cluster_leader': ('gauge', '1 when this node is the cluster leader and may write to Cloudflare'),
+    'cfauto_cluster_nodes_alive': ('gauge', 'Cluster nodes heard from within CLUSTER_PEER_TIMEOUT, including this one'),
+    'cfauto_flap_penalty': ('gauge', 'Decayed flap penalty per backend'),
+    'cfauto_backend_suppressed': ('gauge', '1 while a backend is suppressed by flap dampening'),
+    'cfauto_dampened_changes_total': ('counter', 'DNS changes held back by flap dampening or the hold time'),
+}
+
+health_cache = {}  # (ip, port) -> {'checked_at': ..., 'task': ...}
+health_cache_stats = {'hits': 0, 'misses': 0}
+probe_limit = {'semaphore': None, 'loop': None, 'size': None}  # سقف PROBE_CONCURRENCY برای همه اتصال‌های بررسی
+record_index = {}  # zone_id -> {'fetched_at': ..., 'etag': ..., 'records': {record_id: {'name', 'content', 'type'}}}
+probe_store = {'db': None, 'compacted_at': 0}
+status_state = {'dirty': False, 'legacy': {}}
+backend_load = Counter()  # ip -> number of records pointing at it in this cycle
+http_sessions = {}  # host -> requests.Session
+http_sessions_lock = threading.Lock()
+token_buckets = {}  # host -> token bucket
+metrics = {}  # name -> {labels: value}; histogram values are {'buckets', 'sum', 'count'}
+metrics_lock = threading.Lock()
+flap_state = {'penalties': {}, 'suppressed': set(), 'changed_at': {}}  # penalties: (ip, port) -> penalty; changed_at: (zone_id, name) -> last DNS change in either mode, saved in status.json
+config_state = {'mtime': None, 'overridden': set()}  # overridden: تنظیماتی که از خط فرمان آمده‌اند
+cluster_state = {'peers': {}, 'results': {}, 'last_status': None, 'transport': None}  # peers: node_id -> {'seen_at', 'results', 'overrides'}
+
+def inc_counter(name, labels=(), value=1):
+    with metrics_lock:
+        series = metrics.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + value
+
+def set_gauge(name, value, labels=()):
+    with metrics_lock:
+        metrics.setdefault(name, {})[labels] = value
+
+def observe(name, value, labels=()):
+    with metrics_lock:
+        series = metrics.setdefault(name, {})
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0, 'count': 0}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram['buckets'][i] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+def observe_since(name, started, labels=()):
+    now = time.monotonic()
+    observe(name, now - started, labels)
+    return now
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+def render_metrics():
+    lines = []
+    with metrics_lock:
+        for name, (metric_type, description) in METRIC_TYPES.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in sorted(metrics.get(name, {}).items()):
+                if metric_type != 'histogram':
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+                    continue
+                for bound, count in zip(LATENCY_BUCKETS, value['buckets']):
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {count}")
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {value['count']}")
+                lines.append(f"{name}_sum{format_labels(labels)} {value['sum']}")
+                lines.append(f"{name}_count{format_labels(labels)} {value['count']}")
+    return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server():
+    if METRICS_ADDRESS is None:
+        return
+    try:
+        server = ThreadingHTTPServer(METRICS_ADDRESS, MetricsHandler)
+    except OSError as e:
+        print(f"Metrics endpoint could not listen on {METRICS_ADDRESS[0]}:{METRICS_ADDRESS[1]}: {e}")
+        return
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics available at http://{METRICS_ADDRESS[0]}:{METRICS_ADDRESS[1]}/metrics")
+
+def create_token_bucket(requests_count, period):
+    return {
+        'capacity': requests_count,
+        'rate': requests_count / period,
+        'tokens': requests_count,
+        'updated': time.monotonic(),
+        'lock': threading.Lock(),
+    }
+
+def take_token(bucket):
+    while True:
+        with bucket['lock']:
+            now = time.monotonic()
+            bucket['tokens'] = min(bucket['capacity'], bucket['tokens'] + (now - bucket['updated']) * bucket['rate'])
+            bucket['updated'] = now
+            if bucket['tokens'] >= 1:
+                bucket['tokens'] -= 1
+                return
+            wait = (1 - bucket['tokens']) / bucket['rate']
+        time.sleep(wait)
+
+def get_token_bucket(host):
+    with http_sessions_lock:
+        if host not in token_buckets:
+            limit = RATE_LIMITS.get(host)
+            token_buckets[host] = create_token_bucket(*limit) if limit else None
+        return token_buckets[host]
+
+def get_session(host):
+    with http_sessions_lock:
+        session = http_sessions.get(host)
+        if session is None:
+            # هر میزبان یک session با اتصال‌های keep-alive دارد
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            http_sessions[host] = session
+        return session
+
+def get_retry_delay(response, attempt):
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return min(float(retry_after), HTTP_BACKOFF_MAX)
+            except ValueError:
+                pass
+        # تلگرام زمان انتظار را در بدنه پاسخ 429 برمی‌گرداند
+        try:
+            retry_after = response.json().get('parameters', {}).get('retry_after')
+        except ValueError:
+            retry_after = None
+        if retry_after:
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+    # full jitter: a random delay up to the exponential backoff cap
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF * 2 ** attempt))
+
+def is_connect_error(e):
+    # the request never reached the server, so sending it again cannot apply it twice
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], 'reason', None) if e.args else None
+    return isinstance(e, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+def http_request(method, url, idempotent=None, **kwargs):
+    # POST (ایجاد رکورد، batch با posts/deletes، پیام تلگرام) فقط وقتی تکرار می‌شود که مطمئن باشیم اعمال نشده: خطای اتصال یا 429
+    if idempotent is None:
+        idempotent = method != 'POST'
+    host = urlsplit(url).hostname
+    session = get_session(host)
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    for attempt in range(HTTP_RETRIES + 1):
+        bucket = get_token_bucket(host)
+        if bucket is not None:
+            take_token(bucket)
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            print(f"{method} {host} failed (attempt {attempt + 1}/{HTTP_RETRIES + 1}): {e}")
+            response = None
+            if not idempotent and not is_connect_error(e):
+                return None
+        else:
+            if response.status_code != 429 and (response.status_code < 500 or not idempotent):
+                return response
+            print(f"{method} {host} returned {response.status_code} (attempt {attempt + 1}/{HTTP_RETRIES + 1})")
+        if attempt < HTTP_RETRIES:
+            time.sleep(get_retry_delay(response, attempt))
+    return response
+
+def cloudflare_endpoint(path):
+    # /zones/<id>/dns_records/<id> -> /zones/:id/dns_records/:id تا تعداد سری‌های متریک محدود بماند
+    parts = path.split('?')[0].strip('/').split('/')
+    return '/' + '/'.join(part if i % 2 == 0 or part == 'batch' else ':id' for i, part in enumerate(parts))
+
+def cloudflare_request(method, path, headers=None, **kwargs):
+    request_headers = {
         'Authorization': f'Bearer {API_TOKEN}',
         'Content-Type': 'application/json'
     }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        records = response.json()['result']
-        # فیلتر کردن ساب‌دامین‌ها بر اساس آی‌پی‌های موجود در لیست
-        allowed_ips = {ip for _, ip in ADDRESSES}
-        return {record['name']: record['content'] for record in records if record['type'] == 'A' and record['content'] in allowed_ips}
-    else:
-        print(f"Error fetching subdomains: {response.status_code}")
+    if headers:
+        request_headers.update(headers)
+    labels = (('method', method), ('endpoint', cloudflare_endpoint(path)))
+    started = time.monotonic()
+    response = http_request(method, f"{CLOUDFLARE_API}{path}", headers=request_headers, **kwargs)
+    observe_since('cfauto_cloudflare_request_seconds', started, labels)
+    if response is None or response.status_code >= 400:
+        inc_counter('cfauto_cloudflare_errors_total', labels + (('status', 'network' if response is None else str(response.status_code)),))
+    return response
+
+def index_entry(record):
+    # ttl و proxied برای ساختن رکوردهای جدید در حالت multi نگه داشته می‌شوند
+    return {'name': record['name'], 'content': record['content'], 'type': record['type'],
+            'ttl': record.get('ttl', 1), 'proxied': record.get('proxied', False)}
+
+def fetch_dns_records(zone_id, etag=None):
+    # رکوردهای A به صورت صفحه به صفحه دریافت می‌شوند تا زون‌های بیش از 100 رکورد هم کامل خوانده شوند
+    records = {}
+    page = 1
+    first_etag = None
+    while True:
+        headers = {'If-None-Match': etag} if page == 1 and etag else None
+        params = {'type': 'A', 'per_page': RECORDS_PER_PAGE, 'page': page}
+        response = cloudflare_request('GET', f"/zones/{zone_id}/dns_records", headers=headers, params=params)
+        if response is not None and response.status_code == 304:
+            return None, etag
+        if response is None or response.status_code != 200:
+            print(f"Error fetching DNS records for zone {zone_id}: {response.status_code if response is not None else 'no response'}")
+            return None, None
+        if page == 1:
+            first_etag = response.headers.get('ETag')
+        body = response.json()
+        for record in body['result']:
+            records[record['id']] = index_entry(record)
+        result_info = body.get('result_info') or {}
+        if page >= result_info.get('total_pages', 1):
+            return records, first_etag
+        page += 1
+
+def store_record_index(zone_id, records, etag):
+    if records is None:
+        if etag is not None:
+            # 304: zone has not changed since the last full listing
+            record_index[zone_id]['fetched_at'] = time.time()
+        return
+    record_index[zone_id] = {'fetched_at': time.time(), 'etag': etag, 'records': records}
+
+async def refresh_record_indexes(zone_ids):
+    # زون‌ها به صورت موازی دریافت می‌شوند و ایندکس فقط در همین thread به‌روزرسانی می‌شود
+    now = time.time()
+    stale = [zone_id for zone_id in zone_ids
+             if zone_id not in record_index or now - record_index[zone_id]['fetched_at'] >= RECORD_INDEX_MAX_AGE]
+    if not stale:
+        return
+    results = await asyncio.gather(*(asyncio.to_thread(fetch_dns_records, zone_id, record_index[zone_id]['etag'] if zone_id in record_index else None)
+                                     for zone_id in stale))
+    for zone_id, (records, etag) in zip(stale, results):
+        store_record_index(zone_id, records, etag)
+    write_record_index()
+
+def find_record_id(zone_id, name):
+    entry = record_index.get(zone_id)
+    if entry is None:
+        return None
+    for record_id, record in entry['records'].items():
+        if record['name'] == name and record['type'] == 'A':
+            return record_id
+    return None
+
+def read_record_index():
+    if not os.path.exists(RECORDS_FILE):
+        return
+    try:
+        with open(RECORDS_FILE, 'r') as file:
+            record_index.update(json.load(file))
+    except (OSError, ValueError) as e:
+        # the index is only a cache; it is rebuilt from Cloudflare on the next cycle
+        quarantine_corrupt_file(RECORDS_FILE, e)
+
+def write_record_index():
+    write_json_atomic(RECORDS_FILE, record_index)
+
+def get_subdomains(zone_id):
+    entry = record_index.get(zone_id)
+    if entry is None:
+        print(f"Error fetching subdomains for zone {zone_id}")
+        return {}
+    # فیلتر کردن ساب‌دامین‌ها بر اساس آی‌پی‌های موجود در لیست
+    allowed_ips = {ip for _, ip, *_ in ADDRESSES}
+    return {record['name']: record['content'] for record in entry['records'].values() if record['type'] == 'A' and record['content'] in allowed_ips}
+
+def get_record_sets(zone_id):
+    # name -> {ip: record_id}، فقط رکوردهایی که به سرورهای ADDRESSES اشاره می‌کنند
+    entry = record_index.get(zone_id)
+    if entry is None:
+        print(f"Error fetching subdomains for zone {zone_id}")
         return {}
+    allowed_ips = {ip for _, ip, *_ in ADDRESSES}
+    record_sets = {}
+    for record_id, record in entry['records'].items():
+        if record['type'] == 'A' and record['content'] in allowed_ips:
+            record_sets.setdefault(record['name'], {})[record['content']] = record_id
+    return record_sets
 
-def check_ping(ip):
+def icmp_checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+def open_icmp_socket():
     try:
-        response_time = ping(ip, timeout=2)
-        if response_time is not None:
-            response_time *= 1000  # Convert to milliseconds
-            response_time = round(response_time, 2)  # Round to 2 decimal places
-        return response_time
-    except Exception as e:
-        print(f"Error pinging {ip}: {e}")
-        return None
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+    except PermissionError:
+        # unprivileged ICMP sockets (net.ipv4.ping_group_range); the kernel owns the echo identifier
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
 
-def check_tcp(ip, port):
+def icmp_batch_ping(ips, timeout=None):
+    if timeout is None:
+        timeout = PING_TIMEOUT  # هنگام اجرا خوانده می‌شود تا ping_timeout فایل تنظیمات اعمال شود
+    # all echo requests leave from one socket, replies are matched by (source, sequence) within a single timeout window
+    sock, raw = open_icmp_socket()
+    results = {ip: None for ip in ips}
+    pending = {}  # (address, sequence) -> (ip, sent_at)
+    identifier = random.randrange(1 << 16)
     try:
-        with socket.create_connection((ip, port), timeout=5):
-            return True
-    except (socket.timeout, ConnectionRefusedError, OSError) as e:
-        print(f"TCP connection to {ip}:{port} failed: {e}")
-        return False
-
-def update_dns_record(record_id, name, new_ip):
-    url = f"https://api.cloudflare.com/client/v4/zones/{ZONE_ID}/dns_records/{record_id}"
-    headers = {
-        'Authorization': f'Bearer {API_TOKEN}',
-        'Content-Type': 'application/json'
+        sock.setblocking(False)
+        for sequence, ip in enumerate(results):
+            try:
+                address = socket.gethostbyname(ip)
+            except OSError as e:
+                print(f"Error resolving {ip}: {e}")
+                continue
+            header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+            checksum = icmp_checksum(header + ICMP_PAYLOAD)
+            packet = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, identifier, sequence) + ICMP_PAYLOAD
+            try:
+                sock.sendto(packet, (address, 0))
+            except OSError as e:
+                print(f"Error pinging {ip}: {e}")
+                continue
+            pending[(address, sequence)] = (ip, time.perf_counter())
+
+        deadline = time.monotonic() + timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                break
+            try:
+                packet, (source, _) = sock.recvfrom(2048)
+            except BlockingIOError:
+                continue
+            received_at = time.perf_counter()
+            if raw:
+                packet = packet[(packet[0] & 0x0f) * 4:]  # skip the IP header
+            if len(packet) < 8:
+                continue
+            icmp_type, _, _, reply_identifier, sequence = struct.unpack('!BBHHH', packet[:8])
+            if icmp_type != ICMP_ECHO_REPLY or (raw and reply_identifier != identifier):
+                continue
+            target = pending.pop((source, sequence), None)
+            if target is not None:
+                ip, sent_at = target
+                results[ip] = round((received_at - sent_at) * 1000, 2)
+    finally:
+        sock.close()
+    return results
+
+def probe_timeout(timeout):
+    # هر بررسی حداکثر FAILOVER_DEADLINE / MAX_ATTEMPTS طول می‌کشد تا MAX_ATTEMPTS بررسی پشت سر هم در مهلت جا شوند
+    return min(timeout, PROBE_DEADLINE, FAILOVER_DEADLINE / max(MAX_ATTEMPTS, 1))
+
+def get_probe_semaphore():
+    # بعد از reload تنظیمات یا در event loop جدید (مثلا benchmark) semaphore دوباره ساخته می‌شود
+    loop = asyncio.get_running_loop()
+    if probe_limit['loop'] is not loop or probe_limit['size'] != PROBE_CONCURRENCY:
+        probe_limit.update(semaphore=asyncio.Semaphore(PROBE_CONCURRENCY), loop=loop, size=PROBE_CONCURRENCY)
+    return probe_limit['semaphore']
+
+async def async_tcp_connect_time(ip, port):
+    # زمان انتظار برای semaphore جزو timeout و RTT حساب نمی‌شود
+    async with get_probe_semaphore():
+        started_at = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout=probe_timeout(TCP_TIMEOUT))
+        except (asyncio.TimeoutError, OSError) as e:
+            print(f"TCP connection to {ip}:{port} failed: {e!r}")
+            return None
+        connect_time = round((time.perf_counter() - started_at) * 1000, 2)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+    return connect_time
+
+def get_probe_config(ip, port):
+    for address_port, address, *probe in ADDRESSES:
+        if address == ip and address_port == port:
+            return probe[0] if probe else {}
+    return {}
+
+async def run_probe(ip, port, probe):
+    # returns an error string, or None when the service answered as expected
+    probe_type = probe.get('type', 'tcp')
+    if probe_type not in ('tcp', 'tls', 'http', 'https', 'send_expect'):
+        return f"unknown probe type {probe_type!r}"
+    context = None
+    if probe_type in ('tls', 'https') or probe.get('tls'):
+        context = ssl.create_default_context()
+        if not probe.get('verify', False):
+            # تونل‌ها معمولاً گواهی self-signed دارند؛ فقط کامل شدن handshake بررسی می‌شود
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+    server_name = probe.get('server_name', ip) if context is not None else None
+    reader, writer = await asyncio.open_connection(ip, port, ssl=context, server_hostname=server_name)
+    try:
+        if probe_type in ('http', 'https'):
+            host = probe.get('host', probe.get('server_name', ip))
+            writer.write(f"GET {probe.get('path', '/')} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: cloudflareAuto_change_ip\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+            status_line = (await reader.readline()).decode('latin-1').split()
+            expected = probe.get('status', 200)
+            expected = expected if isinstance(expected, (list, tuple)) else (expected,)
+            if len(status_line) < 2 or not status_line[1].isdigit() or int(status_line[1]) not in expected:
+                return f"HTTP status {' '.join(status_line[1:2]) or 'missing'}, expected {expected[0] if len(expected) == 1 else list(expected)}"
+        elif probe_type == 'send_expect':
+            send = probe.get('send', b'')
+            writer.write(send.encode() if isinstance(send, str) else send)
+            await writer.drain()
+            expect = probe.get('expect', b'')
+            expect = expect.encode() if isinstance(expect, str) else expect
+            data = b''
+            while expect not in data and len(data) < PROBE_READ_LIMIT:
+                chunk = await reader.read(PROBE_READ_LIMIT - len(data))
+                if not chunk:
+                    return f"connection closed before {expect!r}"
+                data += chunk
+            if expect not in data:
+                return f"{expect!r} not found in the first {PROBE_READ_LIMIT} bytes"
+        return None
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (OSError, ssl.SSLError):
+            pass
+
+async def async_check_service(ip, port):
+    # اتصال TCP، handshake TLS، درخواست HTTP یا ارسال/دریافت بایت طبق probe همان سرور در ADDRESSES
+    probe = get_probe_config(ip, port)
+    async with get_probe_semaphore():
+        started_at = time.perf_counter()
+        try:
+            error = await asyncio.wait_for(run_probe(ip, port, probe), timeout=probe_timeout(probe.get('timeout', TCP_TIMEOUT)))
+        except (asyncio.TimeoutError, OSError) as e:
+            error = f"{probe.get('type', 'tcp')} probe failed: {e!r}"
+        latency = round((time.perf_counter() - started_at) * 1000, 2)
+    degraded = False
+    if error is None and probe.get('max_latency') is not None and latency > probe['max_latency']:
+        # کند بودن بیش از حد هم مانند قطعی حساب می‌شود
+        error = f"{probe.get('type', 'tcp')} latency {latency} ms > {probe['max_latency']} ms"
+        degraded = True
+    if error is not None:
+        print(f"Service check {ip}:{port} failed: {error}")
+    return {'ok': error is None, 'latency': latency, 'degraded': degraded, 'error': error}
+
+async def async_batch_ping(targets):
+    # targets: [(ip, port)] -> {ip: rtt in ms or None}
+    if PING_METHOD != 'tcp':
+        try:
+            return await asyncio.to_thread(icmp_batch_ping, [ip for ip, _ in targets], probe_timeout(PING_TIMEOUT))
+        except OSError as e:
+            if PING_METHOD == 'icmp':
+                print(f"ICMP ping failed: {e}")
+                return {ip: None for ip, _ in targets}
+            print(f"ICMP sockets are not permitted ({e}), using TCP connect time as RTT")
+    results = await asyncio.gather(*(async_tcp_connect_time(ip, port) if port is not None else asyncio.sleep(0)
+                                     for ip, port in targets))
+    return {ip: rtt for (ip, _), rtt in zip(targets, results)}
+
+def open_probe_history():
+    db = sqlite3.connect(PROBE_DB_FILE)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("""CREATE TABLE IF NOT EXISTS probes (
+        ts REAL NOT NULL, ip TEXT NOT NULL, port INTEGER, rtt REAL, tcp INTEGER)""")
+    db.execute("CREATE INDEX IF NOT EXISTS probes_target_ts ON probes (ip, port, ts)")
+    db.execute("""CREATE TABLE IF NOT EXISTS probe_rollups (
+        bucket INTEGER NOT NULL, ip TEXT NOT NULL, port INTEGER,
+        samples INTEGER NOT NULL, rtt_samples INTEGER NOT NULL, rtt_sum REAL NOT NULL,
+        tcp_samples INTEGER NOT NULL, tcp_ok INTEGER NOT NULL,
+        PRIMARY KEY (bucket, ip, port))""")
+    db.commit()
+    probe_store['db'] = db
+
+def record_probe(ip, port, ping_time, tcp_status):
+    # inserts stay in the open transaction until flush_probe_history() commits once per cycle
+    if probe_store['db'] is None:
+        return
+    tcp = None if tcp_status is None else int(tcp_status)
+    probe_store['db'].execute("INSERT INTO probes (ts, ip, port, rtt, tcp) VALUES (?, ?, ?, ?, ?)",
+                              (time.time(), ip, port, ping_time, tcp))
+
+def query_probe_history(ip, port, minutes):
+    if probe_store['db'] is None:
+        return []
+    since = time.time() - minutes * 60
+    rows = probe_store['db'].execute(
+        "SELECT ts, rtt, tcp FROM probes WHERE ip = ? AND port IS ? AND ts >= ? ORDER BY ts",
+        (ip, port, since))
+    return [{'ts': ts, 'ping': rtt, 'tcp': None if tcp is None else bool(tcp)} for ts, rtt, tcp in rows]
+
+def query_probe_stats(ip, port, minutes):
+    # (average rtt, tcp success rate, samples); None where there is no data
+    if probe_store['db'] is None:
+        return None, None, 0
+    since = time.time() - minutes * 60
+    return probe_store['db'].execute(
+        "SELECT AVG(rtt), AVG(tcp), COUNT(*) FROM probes WHERE ip = ? AND port IS ? AND ts >= ?",
+        (ip, port, since)).fetchone()
+
+def compact_probe_history():
+    # raw samples older than PROBE_RETENTION are merged into PROBE_ROLLUP_BUCKET buckets
+    db = probe_store['db']
+    cutoff = time.time() - PROBE_RETENTION
+    db.execute("""INSERT INTO probe_rollups (bucket, ip, port, samples, rtt_samples, rtt_sum, tcp_samples, tcp_ok)
+        SELECT CAST(ts / ? AS INTEGER) * ?, ip, port, COUNT(*), COUNT(rtt), COALESCE(SUM(rtt), 0), COUNT(tcp), COALESCE(SUM(tcp), 0)
+        FROM probes WHERE ts < ? GROUP BY 1, 2, 3
+        ON CONFLICT (bucket, ip, port) DO UPDATE SET
+            samples = samples + excluded.samples,
+            rtt_samples = rtt_samples + excluded.rtt_samples,
+            rtt_sum = rtt_sum + excluded.rtt_sum,
+            tcp_samples = tcp_samples + excluded.tcp_samples,
+            tcp_ok = tcp_ok + excluded.tcp_ok""",
+        (PROBE_ROLLUP_BUCKET, PROBE_ROLLUP_BUCKET, cutoff))
+    db.execute("DELETE FROM probes WHERE ts < ?", (cutoff,))
+    db.execute("DELETE FROM probe_rollups WHERE bucket < ?", (time.time() - PROBE_ROLLUP_RETENTION,))
+    db.commit()
+    probe_store['compacted_at'] = time.time()
+
+def flush_probe_history():
+    if probe_store['db'] is None:
+        return
+    probe_store['db'].commit()
+    if time.time() - probe_store['compacted_at'] >= PROBE_COMPACT_INTERVAL:
+        compact_probe_history()
+
+def get_port(ip):
+    for port, address, *_ in ADDRESSES:
+        if address == ip:
+            return port
+    return None
+
+async def probe_backend(ip, port):
+    return (await probe_backends([(ip, port)]))[(ip, port)]
+
+async def probe_backends(targets):
+    ping_times, service_results = await asyncio.gather(
+        async_batch_ping(targets),
+        asyncio.gather(*(async_check_service(ip, port) if port is not None else asyncio.sleep(0) for ip, port in targets)))
+    results = {}
+    for (ip, port), service in zip(targets, service_results):
+        tcp_status = service['ok'] if service is not None else None
+        record_probe(ip, port, ping_times[ip], tcp_status)
+        labels = (('backend', f"{ip}:{port}"),)
+        if ping_times[ip] is not None:
+            observe('cfauto_probe_rtt_seconds', ping_times[ip] / 1000, labels)
+        inc_counter('cfauto_ping_checks_total', labels + (('result', 'failure' if ping_times[ip] is None else 'success'),))
+        if service is not None:
+            observe('cfauto_service_probe_seconds', service['latency'] / 1000, labels)
+            result = 'success' if service['ok'] else 'degraded' if service['degraded'] else 'failure'
+            inc_counter('cfauto_tcp_checks_total', labels + (('result', result),))
+        results[(ip, port)] = {'ping': ping_times[ip], 'tcp': tcp_status, 'error': service['error'] if service is not None else None}
+    return results
+
+def cache_backend_health(results):
+    now = time.monotonic()
+    for target, health in results.items():
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(health)
+        health_cache[target] = {'checked_at': now, 'task': future}
+
+def is_healthy(health):
+    return health['ping'] is not None and health['tcp'] is not False
+
+async def get_backend_health(ip, port=None):
+    # Every (ip, port) is probed once per TTL; concurrent callers share the in-flight probe
+    if port is None:
+        port = get_port(ip)
+    key = (ip, port)
+    entry = health_cache.get(key)
+    now = time.monotonic()
+    if entry is not None and now - entry['checked_at'] < HEALTH_CACHE_TTL:
+        health_cache_stats['hits'] += 1
+    else:
+        health_cache_stats['misses'] += 1
+        entry = {'checked_at': now, 'task': asyncio.ensure_future(probe_backend(ip, port))}
+        health_cache[key] = entry
+    return await entry['task']
+
+def flap_penalty(ip, port):
+    # تاریخچه بررسی‌ها با همان قواعد failover (MAX_ATTEMPTS خطا برای قطع، REVERT_SUCCESSES موفقیت برای وصل) دوباره مرور می‌شود
+    now = time.time()
+    max_penalty = FLAP_REUSE_LIMIT * 2 ** (FLAP_MAX_SUPPRESS / FLAP_HALF_LIFE)
+    penalty, penalty_at = 0.0, now
+    up, last, streak = True, None, 0
+    for sample in query_probe_history(ip, port, FLAP_HISTORY_MINUTES):
+        healthy = is_healthy(sample)
+        streak = streak + 1 if healthy == last else 1
+        last = healthy
+        if up and not healthy and streak >= MAX_ATTEMPTS:
+            penalty = min(penalty * 0.5 ** ((sample['ts'] - penalty_at) / FLAP_HALF_LIFE) + FLAP_PENALTY, max_penalty)
+            penalty_at = sample['ts']
+            up = False
+        elif not up and healthy and streak >= REVERT_SUCCESSES:
+            up = True
+    return penalty * 0.5 ** ((now - penalty_at) / FLAP_HALF_LIFE)
+
+def update_flap_state():
+    # once per round in the event loop thread; DNS writers in worker threads only read flap_state
+    for port, ip, *_ in ADDRESSES:
+        penalty = flap_penalty(ip, port)
+        flap_state['penalties'][(ip, port)] = penalty
+        # hysteresis: بالای FLAP_SUPPRESS_LIMIT suppress می‌شود و تا زیر FLAP_REUSE_LIMIT نرسد همان‌طور می‌ماند
+        if penalty >= FLAP_SUPPRESS_LIMIT:
+            flap_state['suppressed'].add((ip, port))
+        elif penalty < FLAP_REUSE_LIMIT:
+            flap_state['suppressed'].discard((ip, port))
+        labels = (('backend', f"{ip}:{port}"),)
+        set_gauge('cfauto_flap_penalty', round(penalty, 1), labels)
+        set_gauge('cfauto_backend_suppressed', int((ip, port) in flap_state['suppressed']), labels)
+
+def is_suppressed(ip, port):
+    return (ip, port) in flap_state['suppressed']
+
+def dns_change_allowed(zone_id, subdomain, subdomain_status, new_ip):
+    # جابجایی از سرور قطع شده همیشه مجاز است؛ برگشت به سرور اصلی بعد از DNS_HOLD_TIME و فقط اگر سرور اصلی suppress نشده باشد
+    if new_ip != subdomain_status['original_ip']:
+        return True, None
+    held = DNS_HOLD_TIME - (time.time() - flap_state['changed_at'].get((zone_id, subdomain), 0))
+    if held > 0:
+        return False, f"hold time, {held:.0f} s left"
+    if is_suppressed(new_ip, get_port(new_ip)):
+        return False, f"{new_ip} is suppressed, flap penalty {flap_state['penalties'].get((new_ip, get_port(new_ip)), 0):.0f}"
+    return True, None
+
+def score_backend(ip, port):
+    # lower is better: average RTT, divided by the TCP success rate, scaled up by the records already served
+    average_rtt, success_rate, _ = query_probe_stats(ip, port, PROBE_WINDOW_MINUTES)
+    if average_rtt is None:
+        average_rtt = PING_TIMEOUT * 1000
+    if success_rate is None:
+        success_rate = 1
+    return (average_rtt + RTT_FLOOR) / max(success_rate, 0.05) * (1 + BACKEND_LOAD_WEIGHT * backend_load[ip])
+
+async def find_alternative_ip(subdomain_status):
+    # آی‌پی‌های جایگزین سالم بر اساس RTT، نرخ موفقیت TCP و تعداد رکوردهایی که الان سرویس می‌دهند رتبه‌بندی می‌شوند
+    candidates = [(port, address) for port, address, *_ in ADDRESSES
+                  if address != subdomain_status['original_ip'] and address != subdomain_status['new_ip']]
+    results = await asyncio.gather(*(get_backend_health(address, port) for port, address in candidates))
+    healthy = [(port, address) for (port, address), health in zip(candidates, results) if is_healthy(health)]
+    if not healthy:
+        return None
+    # سرورهای suppress شده فقط وقتی انتخاب می‌شوند که هیچ سرور سالم دیگری نباشد
+    healthy = [(port, address) for port, address in healthy if not is_suppressed(address, port)] or healthy
+    _, address = min(healthy, key=lambda candidate: score_backend(candidate[1], candidate[0]))
+    return address
+
+def plan_ip_change(dns_plan, subdomain, current_ip, new_ip):
+    if subdomain in dns_plan:
+        # برگشت به IP اصلی جای failover همین دور را می‌گیرد؛ بار سرور جایگزین پس گرفته می‌شود
+        backend_load[dns_plan[subdomain]] -= 1
+        backend_load[current_ip] += 1
+    dns_plan[subdomain] = new_ip
+    backend_load[current_ip] -= 1
+    backend_load[new_ip] += 1
+
+def update_dns_record(zone_id, record_id, new_ip):
+    # PATCH مثل patches در batch فقط content را عوض می‌کند؛ PUT مقدار proxied و ttl را به پیش‌فرض برمی‌گرداند
+    response = cloudflare_request('PATCH', f"/zones/{zone_id}/dns_records/{record_id}", json={'content': new_ip})
+    
+    if response is not None and response.status_code == 200:
+        return response.json()['result']
+    else:
+        return None
+
+def batch_update_dns_records(zone_id, changes):
+    data = {
+        'patches': [{'id': record_id, 'content': new_ip} for record_id, new_ip in changes],
     }
+    # patches فقط content را تنظیم می‌کنند، پس تکرار این batch امن است
+    response = cloudflare_request('POST', f"/zones/{zone_id}/dns_records/batch", idempotent=True, json=data)
+
+    if response is not None and response.status_code == 200:
+        return {record['id']: record for record in response.json()['result'].get('patches', [])}
+    else:
+        print(f"Batch DNS update failed: {response.status_code if response is not None else 'no response'}")
+        return None
+
+def create_dns_record(zone_id, post):
+    response = cloudflare_request('POST', f"/zones/{zone_id}/dns_records", json=post)
+    if response is not None and response.status_code == 200:
+        return response.json()['result']
+    return None
+
+def delete_dns_record(zone_id, record_id):
+    response = cloudflare_request('DELETE', f"/zones/{zone_id}/dns_records/{record_id}")
+    return response is not None and response.status_code == 200
+
+def batch_change_record_sets(zone_id, deletes, posts):
+    # deletes و posts در یک درخواست batch و به صورت یک تراکنش اعمال می‌شوند
     data = {
-        'type': 'A',
-        'name': name,
-        'content': new_ip,
+        'deletes': [{'id': record_id} for record_id in deletes],
+        'posts': posts,
     }
-    response = requests.put(url, json=data, headers=headers)
-    
-    if response.status_code == 200:
-        return True
+    response = cloudflare_request('POST', f"/zones/{zone_id}/dns_records/batch", json=data)
+
+    if response is not None and response.status_code == 200:
+        result = response.json()['result']
+        return [record['id'] for record in result.get('deletes') or []], result.get('posts') or []
     else:
-        return False
+        print(f"Batch DNS record set update failed: {response.status_code if response is not None else 'no response'}")
+        return None
 
 def send_telegram_message(message):
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+    url = f"{TELEGRAM_API}/bot{TELEGRAM_TOKEN}/sendMessage"
     data = {
         'chat_id': CHAT_ID,
         'text': message,
         'parse_mode': 'HTML'
     }
-    response = requests.post(url, data=data)
+    response = http_request('POST', url, data=data)
+    if response is None:
+        inc_counter('cfauto_telegram_messages_total', (('result', 'failure'),))
+        print("Telegram message could not be sent")
+        return
+    inc_counter('cfauto_telegram_messages_total', (('result', 'success' if response.status_code == 200 else 'failure'),))
     print("Telegram Status Code:", response.status_code)
-    print("Telegram Response JSON:", response.json())
+    try:
+        print("Telegram Response JSON:", response.json())
+    except ValueError:
+        # مثلا صفحه HTML خطای 502 بعد از تمام شدن retryها
+        print("Telegram Response Text:", response.text[:200])
+
+def split_message(message):
+    # پیام‌های طولانی روی مرز خطوط به چند پیام زیر TELEGRAM_MAX_LENGTH تقسیم می‌شوند
+    chunks = []
+    chunk = ''
+    for line in message.split('\n'):
+        while len(line) > TELEGRAM_MAX_LENGTH:
+            if chunk:
+                chunks.append(chunk)
+                chunk = ''
+            chunks.append(line[:TELEGRAM_MAX_LENGTH])
+            line = line[TELEGRAM_MAX_LENGTH:]
+        if chunk and len(chunk) + 1 + len(line) > TELEGRAM_MAX_LENGTH:
+            chunks.append(chunk)
+            chunk = line
+        else:
+            chunk = f"{chunk}\n{line}" if chunk else line
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+async def notifier(queue):
+    # (zone_id, line) از صف خوانده می‌شود؛ ارسال در thread جدا انجام می‌شود تا حلقه بررسی منتظر تلگرام نماند
+    while True:
+        pending = {}
+        zone_id, line = await queue.get()
+        set_gauge('cfauto_telegram_queue_depth', queue.qsize())
+        pending.setdefault(zone_id, []).append(line)
+        deadline = time.monotonic() + NOTIFY_COALESCE_WINDOW
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                zone_id, line = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            set_gauge('cfauto_telegram_queue_depth', queue.qsize())
+            pending.setdefault(zone_id, []).append(line)
+        for zone_id, lines in pending.items():
+            for chunk in split_message(f"Zone ID: {zone_id}\n" + "\n".join(lines)):
+                try:
+                    await asyncio.to_thread(send_telegram_message, chunk)
+                except Exception as e:
+                    # یک ارسال خراب نباید کل صف هشدارها را متوقف کند
+                    inc_counter('cfauto_telegram_messages_total', (('result', 'failure'),))
+                    print(f"Telegram message failed: {e}")
+
+def write_json_atomic(path, data, indent=None):
+    # write-to-temp + fsync + rename: a crash leaves either the old file or the new one, never half of each
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(data, file, indent=indent)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+def quarantine_corrupt_file(path, error):
+    corrupt_path = f"{path}.corrupt-{int(time.time())}"
+    os.replace(path, corrupt_path)
+    print(f"{path} is corrupt ({error}), moved to {corrupt_path}")
 
 def read_status_file():
-    if os.path.exists(STATUS_FILE):
+    if not os.path.exists(STATUS_FILE):
+        return {}
+    try:
         with open(STATUS_FILE, 'r') as file:
-            return json.load(file)
-    return {}
+            data = json.load(file)
+        if not isinstance(data, dict):
+            raise ValueError("top level is not an object")
+    except (OSError, ValueError) as e:
+        quarantine_corrupt_file(STATUS_FILE, e)
+        return {}
+    if 'schema_version' not in data:
+        # schema 1: the whole file was the subdomain map
+        status_state['legacy'] = data
+        return {}
+    if data['schema_version'] > STATUS_SCHEMA_VERSION:
+        print(f"{STATUS_FILE} has schema version {data['schema_version']}, newer than {STATUS_SCHEMA_VERSION}")
+    if data['schema_version'] < 3:
+        # schema 2: subdomains were not keyed by zone
+        status_state['legacy'] = data.get('subdomains', {})
+        return {}
+    status_state['legacy'] = data.get('legacy', {})
+    zones = data.get('zones', {})
+    for zone_id, names in data.get('changed_at', {}).items():
+        for name, changed_at in names.items():
+            flap_state['changed_at'][(zone_id, name)] = changed_at
+    for zone_id, zone_status in zones.items():
+        for subdomain, subdomain_status in zone_status.items():
+            # نسخه قبلی زمان آخرین تغییر حالت single را داخل وضعیت ساب‌دامین نگه می‌داشت
+            if 'changed_at' in subdomain_status:
+                flap_state['changed_at'].setdefault((zone_id, subdomain), subdomain_status.pop('changed_at'))
+    return zones
 
 def write_status_file(status):
-    with open(STATUS_FILE, 'w') as file:
-        json.dump(status, file, indent=4)
+    data = {'schema_version': STATUS_SCHEMA_VERSION, 'zones': status}
+    now = time.time()
+    changed_at = {}
+    for (zone_id, name), timestamp in list(flap_state['changed_at'].items()):
+        if now - timestamp >= DNS_HOLD_TIME:
+            del flap_state['changed_at'][(zone_id, name)]  # بعد از hold time دیگر لازم نیست
+            continue
+        changed_at.setdefault(zone_id, {})[name] = timestamp
+    if changed_at:
+        data['changed_at'] = changed_at  # (zone_id, name) -> زمان آخرین تغییر DNS در هر دو حالت
+    if status_state['legacy']:
+        data['legacy'] = status_state['legacy']  # entries not yet matched to a zone
+    write_json_atomic(STATUS_FILE, data, indent=4)
+    status_state['dirty'] = False
 
-def check_subdomain_status(subdomain, ip, last_status, change_summary, status_summary):
-    ping_time = check_ping(ip)
+def mark_status_dirty(last_status, durable=False):
+    # تغییرات فقط علامت‌گذاری می‌شوند و یک بار در پایان چرخه نوشته می‌شوند؛ تغییرات DNS فوراً نوشته می‌شوند
+    status_state['dirty'] = True
+    if durable:
+        write_status_file(last_status)
+
+def flush_status_file(last_status):
+    if status_state['dirty']:
+        write_status_file(last_status)
+
+async def check_subdomain_status(zone_id, subdomain, ip, last_status, status_summary, dns_plan):
+    health = await get_backend_health(ip)
+    ping_time = health['ping']
     
-    if subdomain not in last_status:
-        last_status[subdomain] = {
+    zone_status = last_status.setdefault(zone_id, {})
+    added = subdomain not in zone_status
+    if added:
+        # status.json های قدیمی فقط بر اساس نام ساب‌دامین کلید داشتند
+        zone_status[subdomain] = status_state['legacy'].pop(subdomain, None) or {
             'original_ip': ip,  # ذخیره آی‌پی اصلی
             'ping_failures': 0,
             'tcp_failures': 0,
             'new_ip': None,
-            'is_restored': False
+            'is_restored': False,
+            'revert_state': 'idle',
+            'revert_successes': 0
         }
     
-    subdomain_status = last_status[subdomain]
+    subdomain_status = zone_status[subdomain]
+    previous = (subdomain_status['ping_failures'], subdomain_status['tcp_failures'])
 
     # بررسی وضعیت پینگ
     if ping_time is None:
         subdomain_status['ping_failures'] += 1
-        if subdomain_status['ping_failures'] >= MAX_ATTEMPTS:
+        if subdomain_status['ping_failures'] >= MAX_ATTEMPTS and not cluster_agrees(ip, get_port(ip), False):
+            status_summary[subdomain] = ('quorum', f"⚠️ {subdomain} (IP: {ip}) - Ping Failed here, waiting for quorum ({cluster_votes(ip, get_port(ip), False)}/{cluster_quorum()})")
+        elif subdomain_status['ping_failures'] >= MAX_ATTEMPTS:
             # Check for alternative IP
-            new_ip = None
-            for port, address in ADDRESSES:
-                if address != subdomain_status['original_ip'] and address != subdomain_status['new_ip'] and check_ping(address) is not None:
-                    new_ip = address
-                    break
+            new_ip = await find_alternative_ip(subdomain_status)
             
             if new_ip:
-                update_ip_for_subdomain(subdomain, new_ip, subdomain_status, last_status, change_summary)
+                plan_ip_change(dns_plan, subdomain, ip, new_ip)
             else:
-                change_summary.append(f"❌ {subdomain} (IP: {ip}) - Ping: None ms | Ping Failed after {MAX_ATTEMPTS} attempts. No alternative IP found.")
+                # مثل بقیه وضعیت‌ها فقط یک بار (هنگام تغییر) به تلگرام می‌رود، نه در هر دور
+                status_summary[subdomain] = ('no_alternative', f"❌ {subdomain} (IP: {ip}) - Ping: None ms | Ping Failed after {MAX_ATTEMPTS} attempts. No alternative IP found.")
         else:
-            status_summary.append(f"⚠️ {subdomain} (IP: {ip}) - Ping: None ms | Ping Failed (Attempt {subdomain_status['ping_failures']}/{MAX_ATTEMPTS})")
+            status_summary[subdomain] = ('ping', f"⚠️ {subdomain} (IP: {ip}) - Ping: None ms | Ping Failed (Attempt {subdomain_status['ping_failures']}/{MAX_ATTEMPTS})")
     else:
         subdomain_status['ping_failures'] = 0
         
         # بررسی وضعیت TCP برای IP فعلی
-        tcp_status = None
-        for port, address in ADDRESSES:
-            if address == ip:
-                tcp_status = check_tcp(ip, port)
-                break
+        tcp_status = health['tcp']
         
         if tcp_status:
             subdomain_status['tcp_failures'] = 0
 
             # در اینجا ما فقط موفقیت را ثبت می‌کنیم، بررسی بازگشت به آی‌پی اصلی جداگانه انجام می‌شود
-            status_summary.append(f"✅ {subdomain} (IP: {ip}) - Ping: {ping_time} ms | TCP: Success")
+            status_summary[subdomain] = ('ok', f"✅ {subdomain} (IP: {ip}) - Ping: {ping_time} ms | TCP: Success")
         else:
             subdomain_status['tcp_failures'] += 1
-            if subdomain_status['tcp_failures'] >= MAX_ATTEMPTS:
-                new_ip = None
-                for port, address in ADDRESSES:
-                    if address != subdomain_status['original_ip'] and address != subdomain_status['new_ip'] and check_ping(address) is not None:
-                        new_ip = address
-                        break
+            if subdomain_status['tcp_failures'] >= MAX_ATTEMPTS and not cluster_agrees(ip, get_port(ip), False):
+                status_summary[subdomain] = ('quorum', f"⚠️ {subdomain} (IP: {ip}) - TCP Failed here, waiting for quorum ({cluster_votes(ip, get_port(ip), False)}/{cluster_quorum()})")
+            elif subdomain_status['tcp_failures'] >= MAX_ATTEMPTS:
+                new_ip = await find_alternative_ip(subdomain_status)
                 
                 if new_ip:
-                    update_ip_for_subdomain(subdomain, new_ip, subdomain_status, last_status, change_summary)
+                    plan_ip_change(dns_plan, subdomain, ip, new_ip)
                 else:
-                    change_summary.append(f"❌ {subdomain} (IP: {ip}) - TCP: Failed after {MAX_ATTEMPTS} attempts. No alternative IP found.")
+                    status_summary[subdomain] = ('no_alternative', f"❌ {subdomain} (IP: {ip}) - TCP: Failed after {MAX_ATTEMPTS} attempts. No alternative IP found.")
             else:
-                status_summary.append(f"⚠️ {subdomain} (IP: {ip}) - Ping: {ping_time} ms | TCP: Failed (Attempt {subdomain_status['tcp_failures']}/{MAX_ATTEMPTS})")
+                status_summary[subdomain] = ('tcp', f"⚠️ {subdomain} (IP: {ip}) - Ping: {ping_time} ms | TCP: Failed (Attempt {subdomain_status['tcp_failures']}/{MAX_ATTEMPTS}){' - ' + health['error'] if health.get('error') else ''}")
         
-        write_status_file(last_status)  # Update the status file after successful ping and TCP check
+    # status.json فقط وقتی دوباره نوشته می‌شود که شمارنده‌ها واقعاً تغییر کرده باشند
+    if added or (subdomain_status['ping_failures'], subdomain_status['tcp_failures']) != previous:
+        mark_status_dirty(last_status)
 
-def check_for_revert_to_original_ip(subdomain, last_status, change_summary):
-    subdomain_status = last_status[subdomain]
+async def check_for_revert_to_original_ip(zone_id, subdomain, last_status, dns_plan):
+    subdomain_status = last_status[zone_id][subdomain]
     original_ip = subdomain_status['original_ip']
-    
-    if subdomain_status['new_ip'] is not None:
-        successful_pings = 0
-        successful_tcps = 0
-        
-        # 3 تلاش برای پینگ
-        for _ in range(3):
-            if check_ping(original_ip) is not None:
-                successful_pings += 1
-            time.sleep(2)  # فاصله 2 ثانیه‌ای بین تلاش‌ها
-        
-        if successful_pings == 3:
-            # 3 تلاش برای TCP
-            for port, address in ADDRESSES:
-                if address == original_ip:
-                    for _ in range(3):
-                        if check_tcp(original_ip, port):
-                            successful_tcps += 1
-                        time.sleep(2)  # فاصله 2 ثانیه‌ای بین تلاش‌ها
-                    break
-            
-            if successful_tcps == 3:
-                update_ip_for_subdomain(subdomain, original_ip, subdomain_status, last_status, change_summary)
-                subdomain_status['new_ip'] = None  # Resetting new_ip after revert
-                change_summary.append(f"✅ {subdomain} (IP: {original_ip}) - Successfully reverted to original IP after 3 successful ping and TCP tests.")
-                write_status_file(last_status)
-
-def update_ip_for_subdomain(subdomain, new_ip, subdomain_status, last_status, change_summary):
-    url = f"https://api.cloudflare.com/client/v4/zones/{ZONE_ID}/dns_records"
-    headers = {
-        'Authorization': f'Bearer {API_TOKEN}',
-        'Content-Type': 'application/json'
-    }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        records = response.json()['result']
-        for record in records:
-            if record['name'] == subdomain:
-                record_id = record['id']
-                if update_dns_record(record_id, subdomain, new_ip):
-                    if new_ip == subdomain_status['original_ip']:
-                        subdomain_status['new_ip'] = None  # بازگشت به آی‌پی اصلی و تنظیم new_ip به None
-                        change_summary.append(f"✅ {subdomain} (IP: {new_ip}) - Successfully reverted to original IP after 3 successful ping and TCP tests.")
-                    else:
-                        subdomain_status['new_ip'] = new_ip  # به‌روزرسانی new_ip فقط اگر آی‌پی جدید باشد
-                        change_summary.append(f"❌ {subdomain} (IP: {subdomain_status['original_ip']}) - IP جدید: {new_ip} تغییر یافت")
-                    break
-        write_status_file(last_status)  # Update the status file immediately after IP change
+    previous = (subdomain_status.get('revert_state', 'idle'), subdomain_status.get('revert_successes', 0))
+
+    if subdomain_status['new_ip'] is None:
+        subdomain_status['revert_state'] = 'idle'  # idle -> waiting -> verifying -> idle
+        subdomain_status['revert_successes'] = 0
     else:
-        print(f"Error fetching DNS records: {response.status_code}")
+        # سرور اصلی در هر چرخه فقط یک بار (از کش سلامت) بررسی می‌شود و موفقیت‌های پشت سر هم در status.json شمرده می‌شوند
+        health = await get_backend_health(original_ip)
+        if health['ping'] is None or not health['tcp']:
+            subdomain_status['revert_state'] = 'waiting'
+            subdomain_status['revert_successes'] = 0
+        else:
+            subdomain_status['revert_state'] = 'verifying'
+            subdomain_status['revert_successes'] = previous[1] + 1
+            if subdomain_status['revert_successes'] >= REVERT_SUCCESSES and cluster_agrees(original_ip, get_port(original_ip), True):
+                # برگشتی که hold time یا suppress جلویش را می‌گیرد نباید failover از سرور قطع شده را هم خنثی کند
+                if subdomain not in dns_plan or dns_change_allowed(zone_id, subdomain, subdomain_status, original_ip)[0]:
+                    plan_ip_change(dns_plan, subdomain, subdomain_status['new_ip'], original_ip)
 
-def main():
-    last_status = read_status_file()
-    
+    if (subdomain_status['revert_state'], subdomain_status['revert_successes']) != previous:
+        mark_status_dirty(last_status)
+
+def record_ip_change(zone_id, subdomain, new_ip, subdomain_status, change_summary):
+    kind = 'revert' if new_ip == subdomain_status['original_ip'] else 'failover'
+    inc_counter('cfauto_ip_changes_total', (('zone', zone_id), ('kind', kind)))
+    flap_state['changed_at'][(zone_id, subdomain)] = time.time()
+    if kind == 'revert':
+        subdomain_status['new_ip'] = None  # بازگشت به آی‌پی اصلی و تنظیم new_ip به None
+        subdomain_status['revert_state'] = 'idle'
+        subdomain_status['revert_successes'] = 0
+        change_summary.append(f"✅ {subdomain} (IP: {new_ip}) - Successfully reverted to original IP after {REVERT_SUCCESSES} successful ping and TCP checks.")
+    else:
+        subdomain_status['new_ip'] = new_ip  # به‌روزرسانی new_ip فقط اگر آی‌پی جدید باشد
+        change_summary.append(f"❌ {subdomain} (IP: {subdomain_status['original_ip']}) - IP جدید: {new_ip} تغییر یافت")
+
+def prepare_dns_plan(zone_id, dns_plan, last_status, change_summary):
+    # event loop thread: hold time، suppress و شناسه رکوردها قبل از ارسال بررسی می‌شوند
+    changes = []
+    for subdomain, new_ip in dns_plan.items():
+        subdomain_status = last_status.get(zone_id, {}).get(subdomain)
+        if subdomain_status is None:
+            continue
+        record_id = find_record_id(zone_id, subdomain)
+        if record_id is None:
+            change_summary.append(f"⚠️ {subdomain} - DNS record not found, change to {new_ip} skipped")
+            continue
+        if record_index[zone_id]['records'][record_id]['content'] == new_ip:
+            continue  # برنامه‌ای که در حین ارسال قبلی ساخته شده و دیگر لازم نیست
+        allowed, reason = dns_change_allowed(zone_id, subdomain, subdomain_status, new_ip)
+        if not allowed:
+            inc_counter('cfauto_dampened_changes_total', (('zone', zone_id),))
+            print(f"{subdomain}: change to {new_ip} held back ({reason})")
+            continue
+        changes.append((subdomain, record_id, new_ip))
+    return changes
+
+def send_dns_changes(zone_id, changes):
+    # worker thread: فقط درخواست‌های کلودفلر؛ هر DNS_BATCH_SIZE رکورد در یک درخواست batch
+    updated = {}
+    for start in range(0, len(changes), DNS_BATCH_SIZE):
+        chunk = changes[start:start + DNS_BATCH_SIZE]
+        records = batch_update_dns_records(zone_id, [(record_id, new_ip) for _, record_id, new_ip in chunk])
+        if records is None:
+            # Cloudflare runs a batch as one transaction, so after a failure every record is sent on its own to find the bad ones
+            with ThreadPoolExecutor(max_workers=DNS_UPDATE_WORKERS) as executor:
+                results = executor.map(lambda change: update_dns_record(zone_id, change[1], change[2]), chunk)
+                records = {record['id']: record for record in results if record is not None}
+        updated.update(records)
+    return updated
+
+def commit_dns_changes(zone_id, changes, updated, last_status, change_summary):
+    # event loop thread: نتیجه ارسال در ایندکس رکوردها و status.json ثبت می‌شود
+    entry = record_index.get(zone_id)
+    for subdomain, record_id, new_ip in changes:
+        record = updated.get(record_id)
+        if record is None:
+            if entry is not None:
+                entry['fetched_at'] = 0
+            change_summary.append(f"⚠️ {subdomain} - DNS update to {new_ip} failed")
+            continue
+        if entry is not None:
+            entry['records'][record_id] = index_entry(record)
+        subdomain_status = last_status.get(zone_id, {}).get(subdomain)
+        if subdomain_status is not None:
+            record_ip_change(zone_id, subdomain, new_ip, subdomain_status, change_summary)
+
+    if changes:
+        write_record_index()
+        mark_status_dirty(last_status, durable=True)
+
+def plan_record_sets(record_sets, up_ips, down_ips):
+    # returns [(name, ips to add, [(ip, record_id)] to delete)]: only records that have to change are touched
+    plan = []
+    for name, current in record_sets.items():
+        # رکورد سرورهایی که هنوز بررسی نشده‌اند نه حذف می‌شود نه اضافه؛ سالم‌ها اول نگه داشته می‌شوند، بقیه به ترتیب کمترین بار اضافه می‌شوند
+        keep = sorted((ip for ip in current if ip not in down_ips), key=lambda ip: ip not in up_ips)
+        candidates = sorted((ip for ip in up_ips if ip not in current), key=lambda ip: (is_suppressed(ip, get_port(ip)), backend_load[ip], score_backend(ip, get_port(ip))))
+        desired = (keep + candidates)[:MULTI_IP_COUNT] if MULTI_IP_COUNT else keep + candidates
+        if not desired:
+            continue  # هیچ سرور سالمی نیست: رکوردها دست نمی‌خورند تا ساب‌دامین بدون رکورد نماند
+        adds = [ip for ip in desired if ip not in current]
+        deletes = [(ip, record_id) for ip, record_id in current.items() if ip not in desired]
+        if adds or deletes:
+            plan.append((name, adds, deletes))
+            backend_load.update(adds)
+            backend_load.subtract(ip for ip, _ in deletes)
+    return plan
+
+def dampen_record_set_plan(zone_id, plan):
+    # حذف سرور قطع شده منتظر نمی‌ماند؛ اضافه کردن سرور فقط بعد از DNS_HOLD_TIME و اگر سرور suppress نشده باشد
+    record_sets = get_record_sets(zone_id)
+    now = time.time()
+    dampened = []
+    for name, adds, deletes in plan:
+        if adds and len(deletes) >= len(record_sets.get(name, {})):
+            # همه IP های فعلی قطع‌اند: مثل failover در حالت single جایگزین بدون hold time و suppress اضافه می‌شود
+            dampened.append((name, adds, deletes))
+            continue
+        held = DNS_HOLD_TIME - (now - flap_state['changed_at'].get((zone_id, name), 0)) > 0
+        allowed_adds = [] if held else [ip for ip in adds if not is_suppressed(ip, get_port(ip))]
+        if len(allowed_adds) < len(adds):
+            inc_counter('cfauto_dampened_changes_total', (('zone', zone_id),), len(adds) - len(allowed_adds))
+        if not allowed_adds and len(deletes) >= len(record_sets.get(name, {})):
+            continue  # بدون رکورد جدید، آخرین رکوردها حذف نمی‌شوند
+        if allowed_adds or deletes:
+            dampened.append((name, allowed_adds, deletes))
+    return dampened
+
+def prepare_record_set_plan(zone_id, plan):
+    # event loop thread: returns [(name, posts, [(ip, record_id)] to delete, records the name has now)]
+    records = record_index[zone_id]['records']
+    record_sets = get_record_sets(zone_id)
+    changes = []
+    for name, adds, deletes in dampen_record_set_plan(zone_id, plan):
+        template = next((record for record in records.values() if record['name'] == name and record['type'] == 'A'), {})
+        posts = [{'type': 'A', 'name': name, 'content': ip, 'ttl': template.get('ttl', 1), 'proxied': template.get('proxied', False)} for ip in adds]
+        changes.append((name, posts, deletes, len(record_sets.get(name, {}))))
+    return changes
+
+def send_record_set_changes(zone_id, changes):
+    # worker thread: فقط درخواست‌های کلودفلر؛ returns [(chunk, deleted record ids, posted records, batch failed)]
+    results = []
+    start = 0
+    while start < len(changes):
+        # تغییرات هر ساب‌دامین در یک batch می‌مانند تا نیمه‌کاره اعمال نشوند
+        end = start + 1
+        size = len(changes[start][1]) + len(changes[start][2])
+        while end < len(changes) and size + len(changes[end][1]) + len(changes[end][2]) <= DNS_BATCH_SIZE:
+            size += len(changes[end][1]) + len(changes[end][2])
+            end += 1
+        chunk = changes[start:end]
+        start = end
+        result = batch_change_record_sets(zone_id, [record_id for _, _, deletes, _ in chunk for _, record_id in deletes],
+                                          [post for _, posts, _, _ in chunk for post in posts])
+        if result is None:
+            # اول رکوردهای جدید ساخته می‌شوند، بعد رکوردهای قدیمی حذف می‌شوند تا ساب‌دامین هیچ وقت بدون رکورد نماند
+            with ThreadPoolExecutor(max_workers=DNS_UPDATE_WORKERS) as executor:
+                posted = [record for record in executor.map(lambda post: create_dns_record(zone_id, post), [post for _, posts, _, _ in chunk for post in posts])
+                          if record is not None]
+                posted_names = {record['name'] for record in posted}
+                safe_deletes = [record_id for name, _, deletes, current in chunk for ip, record_id in deletes
+                                if name in posted_names or len(deletes) < current]
+                deleted = [record_id for record_id, ok in zip(safe_deletes, executor.map(lambda record_id: delete_dns_record(zone_id, record_id), safe_deletes)) if ok]
+        else:
+            deleted, posted = result
+        results.append((chunk, deleted, posted, result is None))
+    return results
+
+def commit_record_set_changes(zone_id, results, last_status, change_summary):
+    # event loop thread: نتیجه ارسال در ایندکس رکوردها و status.json ثبت می‌شود
+    entry = record_index.get(zone_id)
+    for chunk, deleted, posted, batch_failed in results:
+        if entry is not None:
+            if batch_failed:
+                entry['fetched_at'] = 0
+            for record_id in deleted:
+                entry['records'].pop(record_id, None)
+            for record in posted:
+                entry['records'][record['id']] = index_entry(record)
+        deleted = set(deleted)
+        posted_ips = {(record['name'], record['content']) for record in posted}
+        for name, posts, deletes, _ in chunk:
+            added = [post['content'] for post in posts if (name, post['content']) in posted_ips]
+            removed = [ip for ip, record_id in deletes if record_id in deleted]
+            inc_counter('cfauto_ip_changes_total', (('zone', zone_id), ('kind', 'add')), len(added))
+            inc_counter('cfauto_ip_changes_total', (('zone', zone_id), ('kind', 'remove')), len(removed))
+            if added or removed:
+                flap_state['changed_at'][(zone_id, name)] = time.time()
+                mark_status_dirty(last_status)
+                change_summary.append(f"🔀 {name} - IP اضافه شده: {', '.join(added) or '-'} | IP حذف شده: {', '.join(removed) or '-'}")
+            if len(added) < len(posts) or len(removed) < len(deletes):
+                change_summary.append(f"⚠️ {name} - DNS record set update partly failed")
+
+    if results:
+        write_record_index()
+        flush_status_file(last_status)  # hold time تغییرات بعد از ری‌استارت هم معتبر می‌ماند
+
+def plan_record_set_changes(zone_ids, probe_state):
+    # حالت multi بدون شمارنده است: برنامه هر بار از رکوردهای فعلی و وضعیت سرورها دوباره ساخته می‌شود
+    record_sets = {zone_id: get_record_sets(zone_id) for zone_id in zone_ids}
+    backend_load.clear()
+    for zone_record_sets in record_sets.values():
+        for current in zone_record_sets.values():
+            backend_load.update(current.keys())
+    up_ips = {ip for (ip, _), state in probe_state.items() if state['up']}
+    down_ips = {ip for (ip, _), state in probe_state.items() if state['up'] is False}
+    return {zone_id: plan_record_sets(zone_record_sets, up_ips, down_ips) for zone_id, zone_record_sets in record_sets.items()}
+
+async def dns_writer(pending, last_status, probe_state, queue):
+    # درخواست‌های کلودفلر کنار حلقه بررسی اجرا می‌شوند تا کند بودن API یا 429 زمان‌بندی بررسی‌ها را عقب نیندازد؛
+    # برنامه‌هایی که در این مدت ساخته می‌شوند در pending جمع و در دور بعد همین task ارسال می‌شوند
+    while pending:
+        started = time.monotonic()
+        zone_plans = dict(pending)
+        pending.clear()
+        if DNS_MODE == 'multi':
+            zone_plans = plan_record_set_changes(list(zone_plans), probe_state)
+        if not is_cluster_leader():
+            print(f"Not the cluster leader ({cluster_leader()} is), leaving DNS changes to it")
+            return
+        for zone_id, dns_plan in zone_plans.items():
+            change_summary = []
+            try:
+                if zone_id not in record_index or not dns_plan:
+                    continue
+                if DNS_MODE == 'multi':
+                    changes = prepare_record_set_plan(zone_id, dns_plan)
+                    results = await asyncio.to_thread(send_record_set_changes, zone_id, changes)
+                    commit_record_set_changes(zone_id, results, last_status, change_summary)
+                else:
+                    changes = prepare_dns_plan(zone_id, dns_plan, last_status, change_summary)
+                    updated = await asyncio.to_thread(send_dns_changes, zone_id, changes)
+                    commit_dns_changes(zone_id, changes, updated, last_status, change_summary)
+            except Exception as e:
+                # خطای یک زون نباید بقیه زون‌ها یا تغییرات بعدی را متوقف کند
+                print(f"DNS update for zone {zone_id} failed: {e!r}")
+            for line in change_summary:
+                queue.put_nowait((zone_id, line))
+        set_gauge('cfauto_telegram_queue_depth', queue.qsize())
+        observe_since('cfauto_cycle_phase_seconds', started, (('phase', 'update'),))
+
+async def run_checks(zone_subdomains, probed_ips, last_status, status_summaries, dns_plans):
+    # فقط ساب‌دامین‌هایی بررسی می‌شوند که سرور فعلی یا سرور اصلی آن‌ها در همین دور بررسی شده است
+    semaphore = asyncio.Semaphore(PROBE_CONCURRENCY)
+    backend_load.clear()
+    for subdomains in zone_subdomains.values():
+        backend_load.update(subdomains.values())
+
+    async def check(zone_id, subdomain, ip):
+        async with semaphore:
+            if ip in probed_ips:
+                await check_subdomain_status(zone_id, subdomain, ip, last_status, status_summaries[zone_id], dns_plans[zone_id])
+            subdomain_status = last_status.get(zone_id, {}).get(subdomain)
+            if subdomain_status is not None and subdomain_status['original_ip'] in probed_ips:
+                # اضافه کردن تابع بررسی بازگشت به آی‌پی اصلی
+                await check_for_revert_to_original_ip(zone_id, subdomain, last_status, dns_plans[zone_id])
+
+    await asyncio.gather(*(check(zone_id, subdomain, ip)
+                           for zone_id, subdomains in zone_subdomains.items()
+                           for subdomain, ip in subdomains.items()))
+
+def schedule_probe(schedule, probe_state, target, due):
+    # سرور جدید وضعیت نامعلوم دارد (up = None) و فقط بعد از REVERT_SUCCESSES بررسی موفق پشت سر هم به رکوردها اضافه می‌شود
+    # فقط آخرین نوبت هر سرور معتبر است؛ نوبت‌های قدیمی (مثلا بعد از حذف سرور در تنظیمات) هنگام خارج شدن از heap نادیده گرفته می‌شوند
+    state = probe_state.setdefault(target, {'interval': PROBE_INTERVAL_MIN, 'healthy': None, 'streak': 0, 'up': None})
+    state['due'] = due
+    heapq.heappush(schedule, (due, target))
+
+def update_backend_state(state, target):
+    # در حالت multi: بعد از MAX_ATTEMPTS خطای پشت سر هم (و تأیید quorum) سرور از رکوردها حذف و بعد از REVERT_SUCCESSES موفقیت دوباره اضافه می‌شود
+    if state['healthy'] and state['streak'] >= REVERT_SUCCESSES:
+        state['up'] = True
+    elif not state['healthy'] and state['streak'] >= MAX_ATTEMPTS and cluster_agrees(target[0], target[1], False):
+        state['up'] = False
+
+def schedule_next_probe(schedule, probe_state, target, healthy, started):
+    state = probe_state.setdefault(target, {'interval': PROBE_INTERVAL_MIN, 'healthy': None, 'streak': 0, 'up': None})
+    if healthy != state['healthy']:
+        state['healthy'] = healthy
+        state['streak'] = 0
+    state['streak'] += 1
+    suspect = state['streak'] < (REVERT_SUCCESSES if healthy else MAX_ATTEMPTS)
+    if suspect:
+        # the next probe is timed from this probe's start: MAX_ATTEMPTS - 1 intervals plus the last probe's timeout fit in FAILOVER_DEADLINE
+        state['interval'] = max(FAILOVER_DEADLINE - probe_timeout(PROBE_DEADLINE), 0) / max(MAX_ATTEMPTS - 1, 1)
+    else:
+        state['interval'] = min(max(state['interval'] * 2, PROBE_INTERVAL_MIN), PROBE_INTERVAL_MAX)
+    # بعد از خطا jitter فقط بررسی را جلو می‌اندازد تا مهلت failover رد نشود
+    delay = state['interval'] * random.uniform(1 - PROBE_JITTER, 1 if suspect and not healthy else 1 + PROBE_JITTER)
+    schedule_probe(schedule, probe_state, target, started + delay)
+
+def parse_address_entry(entry):
+    # {ip, port, probe} در فایل تنظیمات -> (port, ip) یا (port, ip, probe) مثل ADDRESSES
+    if isinstance(entry, dict):
+        address = (int(entry['port']), str(entry['ip']))
+        return address + (entry['probe'],) if entry.get('probe') else address
+    return tuple(entry)
+
+def load_config(path):
+    with open(path, 'rb') as file:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ValueError("PyYAML is not installed (pip install pyyaml)")
+            data = yaml.safe_load(file) or {}
+        else:
+            if tomllib is None:
+                raise ValueError("TOML config needs Python 3.11+ or tomli (pip install tomli)")
+            data = tomllib.load(file)
+    values = {}
+    for key, value in data.items():
+        name = key.upper()
+        if name not in CONFIG_KEYS:
+            print(f"Unknown config key {key!r} ignored")
+            continue
+        if name == 'ADDRESSES':
+            value = [parse_address_entry(entry) for entry in value]
+        elif name == 'CLUSTER_PEERS':
+            value = [tuple(peer) for peer in value]
+        elif name in ('CLUSTER_LISTEN', 'METRICS_ADDRESS') and value is not None:
+            value = tuple(value)
+        values[name] = value
+    return values
+
+def apply_config(values, startup=False):
+    # returns the names whose value changed
+    changed = set()
+    for name, value in values.items():
+        if globals()[name] == value or name in config_state['overridden']:
+            continue
+        if name in RESTART_ONLY_KEYS and not startup:
+            print(f"{name} changed in {CONFIG_FILE}; restart to apply it")
+            continue
+        globals()[name] = value
+        changed.add(name)
+    return changed
+
+def read_config(startup=False):
+    try:
+        config_state['mtime'] = os.stat(CONFIG_FILE).st_mtime
+    except FileNotFoundError:
+        config_state['mtime'] = None
+        return None  # بدون فایل تنظیمات، مقادیر داخل همین فایل استفاده می‌شوند
+    try:
+        return apply_config(load_config(CONFIG_FILE), startup)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Config file {CONFIG_FILE} could not be loaded, keeping the running config: {e!r}")
+        return None
+
+async def watch_config(reload_event):
+    while True:
+        await asyncio.sleep(CONFIG_RELOAD_INTERVAL)
+        try:
+            mtime = os.stat(CONFIG_FILE).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime != config_state['mtime']:
+            reload_event.set()
+
+def reconcile_config(schedule, probe_state):
+    # فقط سرورها و زون‌هایی که اضافه یا حذف شده‌اند دوباره بررسی یا ایندکس می‌شوند؛ شمارنده‌ها و تاریخچه بقیه دست نمی‌خورد
+    old_targets = {(ip, port): probe for port, ip, *probe in ADDRESSES}
+    old_zones = set(ZONE_IDS)
+    changed = read_config()
+    if not changed:
+        return
+    new_targets = {(ip, port): probe for port, ip, *probe in ADDRESSES}
+    added = [target for target, probe in new_targets.items() if old_targets.get(target) != probe]
+    removed = [target for target in old_targets if target not in new_targets]
+    now = time.monotonic()
+    for target in removed + added:
+        probe_state.pop(target, None)
+        health_cache.pop(target, None)
+        cluster_state['results'].pop(target, None)
+    for target in added:
+        schedule_probe(schedule, probe_state, target, now)
+    removed_zones = old_zones - set(ZONE_IDS)
+    for zone_id in removed_zones:
+        record_index.pop(zone_id, None)
+    if removed_zones:
+        write_record_index()
+    print(f"Config reloaded ({', '.join(sorted(changed))}): {len(added)} backends added or changed, {len(removed)} removed, "
+          f"{len(set(ZONE_IDS) - old_zones)} zones added, {len(removed_zones)} removed")
+
+def cluster_enabled():
+    return CLUSTER_NODE_ID is not None
+
+def cluster_quorum():
+    return CLUSTER_QUORUM or (len(CLUSTER_PEERS) + 1) // 2 + 1
+
+def alive_nodes():
+    now = time.time()
+    return {CLUSTER_NODE_ID} | {node_id for node_id, peer in cluster_state['peers'].items() if now - peer['seen_at'] < CLUSTER_PEER_TIMEOUT}
+
+def cluster_leader():
+    # کوچک‌ترین شناسه بین نودهای زنده leader است
+    return min(alive_nodes())
+
+def is_cluster_leader():
+    # leader بخش اقلیت (بعد از قطعی شبکه بین نودها) در کلودفلر نمی‌نویسد
+    if not cluster_enabled():
+        return True
+    nodes = alive_nodes()
+    return min(nodes) == CLUSTER_NODE_ID and len(nodes) >= cluster_quorum()
+
+def record_cluster_results(results):
+    now = time.time()
+    for target, health in results.items():
+        cluster_state['results'][target] = (now, is_healthy(health))
+
+def cluster_votes(ip, port, healthy):
+    now = time.time()
+    votes = 0
+    for results in [cluster_state['results']] + [peer['results'] for peer in cluster_state['peers'].values()]:
+        result = results.get((ip, port))
+        if result is not None and now - result[0] < CLUSTER_RESULT_MAX_AGE and result[1] == healthy:
+            votes += 1
+    return votes
+
+def cluster_agrees(ip, port, healthy):
+    if not cluster_enabled():
+        return True
+    return cluster_votes(ip, port, healthy) >= cluster_quorum()
+
+def encode_cluster_message(payload):
+    body = json.dumps(payload, separators=(',', ':')).encode()
+    signature = hmac.new(CLUSTER_SECRET.encode(), body, hashlib.sha256).hexdigest().encode()
+    return signature + b'\n' + body
+
+def decode_cluster_message(data):
+    signature, _, body = data.partition(b'\n')
+    expected = hmac.new(CLUSTER_SECRET.encode(), body, hashlib.sha256).hexdigest().encode()
+    if not hmac.compare_digest(signature, expected):
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+def sync_from_leader(overrides):
+    # followers در کلودفلر نمی‌نویسند؛ وضعیت failover هر ساب‌دامین از leader گرفته می‌شود
+    last_status = cluster_state['last_status']
+    changed = False
+    for zone_id, zone_overrides in overrides.items():
+        for subdomain, subdomain_status in last_status.get(zone_id, {}).items():
+            new_ip = zone_overrides.get(subdomain)
+            if subdomain_status['new_ip'] == new_ip:
+                continue
+            subdomain_status['new_ip'] = new_ip
+            subdomain_status['ping_failures'] = subdomain_status['tcp_failures'] = 0
+            subdomain_status['revert_state'] = 'idle' if new_ip is None else 'waiting'
+            subdomain_status['revert_successes'] = 0
+            record_id = find_record_id(zone_id, subdomain)
+            if record_id is not None:
+                record_index[zone_id]['records'][record_id]['content'] = new_ip or subdomain_status['original_ip']
+            changed = True
+    if changed:
+        write_record_index()
+        mark_status_dirty(last_status, durable=True)
+
+def handle_cluster_message(data, address):
+    payload = decode_cluster_message(data)
+    if payload is None:
+        print(f"Ignoring cluster message with a bad signature from {address[0]}:{address[1]}")
+        return
+    node_id = payload.get('node')
+    if node_id is None or node_id == CLUSTER_NODE_ID or abs(time.time() - payload.get('ts', 0)) > CLUSTER_PEER_TIMEOUT:
+        return
+    results = {}
+    for target, (checked_at, healthy) in payload.get('results', {}).items():
+        ip, _, port = target.rpartition(':')
+        results[(ip, int(port) if port != 'None' else None)] = (checked_at, healthy)
+    cluster_state['peers'][node_id] = {'seen_at': time.time(), 'results': results}
+    if payload.get('overrides') is not None and cluster_leader() == node_id:
+        sync_from_leader(payload['overrides'])
+
+class ClusterProtocol(asyncio.DatagramProtocol):
+    def connection_made(self, transport):
+        cluster_state['transport'] = transport
+
+    def datagram_received(self, data, address):
+        handle_cluster_message(data, address)
+
+async def cluster_heartbeat():
+    # هر CLUSTER_HEARTBEAT_INTERVAL ثانیه آخرین نتیجه بررسی‌ها (و اگر leader باشد وضعیت failover ها) برای همه نودها ارسال می‌شود
     while True:
-        start_time = time.time()  # ثبت زمان شروع
+        payload = {
+            'node': CLUSTER_NODE_ID,
+            'ts': time.time(),
+            'results': {f"{ip}:{port}": list(result) for (ip, port), result in cluster_state['results'].items()},
+        }
+        leader = is_cluster_leader()
+        if leader:
+            payload['overrides'] = {zone_id: {subdomain: status['new_ip'] for subdomain, status in zone_status.items() if status['new_ip']}
+                                    for zone_id, zone_status in cluster_state['last_status'].items()}
+        message = encode_cluster_message(payload)
+        for host, port in CLUSTER_PEERS:
+            try:
+                cluster_state['transport'].sendto(message, (host, port))
+            except OSError as e:
+                print(f"Cluster message to {host}:{port} failed: {e}")
+        set_gauge('cfauto_cluster_leader', int(leader))
+        set_gauge('cfauto_cluster_nodes_alive', len(alive_nodes()))
+        await asyncio.sleep(CLUSTER_HEARTBEAT_INTERVAL)
+
+async def start_cluster(last_status):
+    if not CLUSTER_SECRET or CLUSTER_SECRET == DEFAULT_CLUSTER_SECRET:
+        # با کلید عمومی هر کسی به پورت UDP دسترسی داشته باشد می‌تواند رأی جعل کند یا خودش را leader جا بزند
+        raise SystemExit("Cluster mode refuses to start with the default CLUSTER_SECRET; set a random shared secret on every node")
+    cluster_state['last_status'] = last_status
+    await asyncio.get_running_loop().create_datagram_endpoint(ClusterProtocol, local_addr=CLUSTER_LISTEN)
+    print(f"Cluster node {CLUSTER_NODE_ID} listening on {CLUSTER_LISTEN[0]}:{CLUSTER_LISTEN[1]}, quorum {cluster_quorum()} of {len(CLUSTER_PEERS) + 1}")
+    return asyncio.create_task(cluster_heartbeat())
+
+async def monitor(last_status):
+    schedule = []  # heap of (due time, (ip, port))
+    probe_state = {}  # (ip, port) -> {'interval', 'healthy', 'streak', 'up', 'due'}
+    now = time.monotonic()
+    for port, ip, *_ in ADDRESSES:
+        schedule_probe(schedule, probe_state, (ip, port), now + random.uniform(0, PROBE_JITTER * PROBE_INTERVAL_MIN))
+    reported = {}  # (zone_id, subdomain) -> آخرین وضعیت ارسال شده
+    queue = asyncio.Queue()
+    notify_task = asyncio.create_task(notifier(queue))
+    cluster_task = await start_cluster(last_status) if cluster_enabled() else None
+    reload_event = asyncio.Event()
+    watch_task = asyncio.create_task(watch_config(reload_event))
+    dns_task = None
+    pending_plans = {}  # zone_id -> برنامه‌ای که هنوز به کلودفلر ارسال نشده
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_event.set)
+    except (NotImplementedError, AttributeError):
+        pass  # Windows: فقط تغییر فایل بررسی می‌شود
 
-        subdomains = get_subdomains()
-        if not subdomains:
-            print("No subdomains found.")
-            time.sleep(120)
+    while True:
+        if not schedule:
+            print("No backends configured in ADDRESSES, waiting for a config change.")
+        try:
+            await asyncio.wait_for(reload_event.wait(), timeout=max(0, schedule[0][0] - time.monotonic()) if schedule else None)
+        except asyncio.TimeoutError:
+            pass
+        if reload_event.is_set():
+            reload_event.clear()
+            reconcile_config(schedule, probe_state)
             continue
-        
-        status_summary = []
-        change_summary = []
-        
-        for subdomain, ip in subdomains.items():
-            check_subdomain_status(subdomain, ip, last_status, change_summary, status_summary)
-            # اضافه کردن تابع بررسی بازگشت به آی‌پی اصلی
-            check_for_revert_to_original_ip(subdomain, last_status, change_summary)
-        
-        if change_summary:
-            message = "\n".join(change_summary)
-            send_telegram_message(message)
-        
-        if status_summary:
-            message = "\n".join(status_summary)
-            send_telegram_message(message)
-        
-        # محاسبه زمان صرف شده در این چرخه
-        elapsed_time = time.time() - start_time
-        print(f"Cycle time: {elapsed_time:.2f} seconds")
-
-        # محاسبه زمان باقیمانده برای رسیدن به 120 ثانیه
-        sleep_time = max(0, 120 - elapsed_time)
-        print(f"Next check in {sleep_time:.2f} seconds...")
-        time.sleep(sleep_time)
+
+        start_time = time.monotonic()  # ثبت زمان شروع
+        targets = []
+        while schedule and schedule[0][0] <= start_time + PROBE_BATCH_WINDOW:
+            due, target = heapq.heappop(schedule)
+            if probe_state.get(target, {}).get('due') == due:
+                targets.append(target)
+        if not targets:
+            continue
+
+        await refresh_record_indexes(ZONE_IDS)
+        zone_subdomains = {zone_id: get_subdomains(zone_id) for zone_id in ZONE_IDS}
+        phase_start = observe_since('cfauto_cycle_phase_seconds', start_time, (('phase', 'fetch_records'),))
+
+        probe_start = time.monotonic()
+        results = await probe_backends(targets)
+        cache_backend_health(results)
+        record_cluster_results(results)
+        for target, health in results.items():
+            schedule_next_probe(schedule, probe_state, target, is_healthy(health), probe_start)
+            update_backend_state(probe_state[target], target)
+        update_flap_state()
+        phase_start = observe_since('cfauto_cycle_phase_seconds', phase_start, (('phase', 'probe'),))
+
+        dns_plans = {zone_id: {} for zone_id in zone_subdomains}  # zone_id -> {subdomain: new ip}
+        status_summaries = {zone_id: {} for zone_id in zone_subdomains}  # subdomain -> (kind, line)
+        if DNS_MODE == 'multi':
+            dns_plans = plan_record_set_changes(zone_subdomains, probe_state)
+        else:
+            await run_checks(zone_subdomains, {ip for ip, _ in targets}, last_status, status_summaries, dns_plans)
+        phase_start = observe_since('cfauto_cycle_phase_seconds', phase_start, (('phase', 'decide'),))
+        leader = is_cluster_leader()
+        if not leader and any(dns_plans.values()):
+            print(f"Not the cluster leader ({cluster_leader()} is), leaving DNS changes to it")
+        for zone_id, dns_plan in dns_plans.items():
+            if dns_plan and leader and DNS_MODE == 'multi':
+                pending_plans[zone_id] = dns_plan
+            elif dns_plan and leader:
+                pending_plans.setdefault(zone_id, {}).update(dns_plan)
+        if pending_plans and (dns_task is None or dns_task.done()):
+            dns_task = asyncio.create_task(dns_writer(pending_plans, last_status, probe_state, queue))
+        flush_probe_history()
+        flush_status_file(last_status)
+        phase_start = observe_since('cfauto_cycle_phase_seconds', phase_start, (('phase', 'persist'),))
+
+        # فقط تغییر وضعیت نسبت به دور قبل ارسال می‌شود؛ حالت پیش‌فرض هر ساب‌دامین سالم فرض می‌شود
+        # در حالت چند سروری فقط leader پیام تلگرام می‌فرستد
+        for zone_id, status_summary in status_summaries.items():
+            for subdomain, (kind, line) in status_summary.items():
+                if reported.get((zone_id, subdomain), 'ok') != kind and leader:
+                    queue.put_nowait((zone_id, line))
+                reported[(zone_id, subdomain)] = kind
+        set_gauge('cfauto_telegram_queue_depth', queue.qsize())
+        observe_since('cfauto_cycle_phase_seconds', phase_start, (('phase', 'notify'),))
+        print(f"Health cache: {health_cache_stats['hits']} hits, {health_cache_stats['misses']} misses")
+        health_cache_stats['hits'] = health_cache_stats['misses'] = 0
+
+        # محاسبه زمان صرف شده در این دور
+        elapsed_time = time.monotonic() - start_time
+        observe('cfauto_cycle_seconds', elapsed_time)
+        print(f"Cycle time: {elapsed_time:.2f} seconds ({len(targets)} backends)")
+
+def parse_address(value):
+    host, _, port = value.rpartition(':')
+    return host, int(port)
+
+def main():
+    global CONFIG_FILE, CLUSTER_NODE_ID, CLUSTER_LISTEN, CLUSTER_PEERS, STATUS_FILE, RECORDS_FILE, PROBE_DB_FILE
+    parser = argparse.ArgumentParser(description="Cloudflare DNS failover for Iran servers")
+    parser.add_argument('--node-id', help="enable cluster mode with this node id")
+    parser.add_argument('--cluster-listen', type=parse_address, help="UDP host:port for cluster messages")
+    parser.add_argument('--peer', type=parse_address, action='append', help="host:port of another node (repeatable)")
+    parser.add_argument('--state-dir', help="directory for status.json, records.json and probes.db")
+    parser.add_argument('--config', help=f"TOML or YAML config file (default {CONFIG_FILE})")
+    args = parser.parse_args()
+    if args.config:
+        CONFIG_FILE = args.config
+    read_config(startup=True)
+    if args.node_id:
+        CLUSTER_NODE_ID = args.node_id
+    if args.cluster_listen:
+        CLUSTER_LISTEN = args.cluster_listen
+    if args.peer:
+        CLUSTER_PEERS = args.peer
+    if args.state_dir:
+        # چند نمونه روی یک سرور (مثلا برای تست روی loopback) فایل‌های وضعیت جدا لازم دارند
+        os.makedirs(args.state_dir, exist_ok=True)
+        STATUS_FILE = os.path.join(args.state_dir, os.path.basename(STATUS_FILE))
+        RECORDS_FILE = os.path.join(args.state_dir, os.path.basename(RECORDS_FILE))
+        PROBE_DB_FILE = os.path.join(args.state_dir, os.path.basename(PROBE_DB_FILE))
+    config_state['overridden'] = {name for name, value in (('CLUSTER_NODE_ID', args.node_id), ('CLUSTER_LISTEN', args.cluster_listen), ('CLUSTER_PEERS', args.peer),
+                                                           ('STATUS_FILE', args.state_dir), ('RECORDS_FILE', args.state_dir), ('PROBE_DB_FILE', args.state_dir)) if value}
+
+    last_status = read_status_file()
+    read_record_index()
+    open_probe_history()
+    start_metrics_server()
+    asyncio.run(monitor(last_status))
 
 if __name__ == "__main__":
     main()
@@ -21,7 +21,7 @@ fi
 echo "Creating requirements.txt..."
 echo "requests" > requirements.txt
 echo "aiohttp" >> requirements.txt
-echo "ping3" >> requirements.txt
+echo "tomli; python_version < '3.11'" >> requirements.txt  # برای config.toml روی Python قدیمی‌تر از 3.11
 
 # نصب کتابخانه‌های Python
 echo "Installing Python dependencies..."
@@ -0,0 +1,127 @@
+# بررسی پیام‌های cluster بدون شبکه: quorum، انتخاب leader و گرفتن وضعیت failover از leader
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cloudflareAuto_change_ip as monitor
+
+PEER_ADDRESS = ('127.0.0.1', 9871)
+BACKEND = ('10.0.0.1', 443)
+
+
+@contextlib.contextmanager
+def cluster_node(node_id='b', peers=2):
+    # این نود و دو peer روی loopback؛ quorum پیش‌فرض 2 از 3 است. همه متغیرهای ماژول بعد از تست برگردانده می‌شوند
+    with tempfile.TemporaryDirectory() as state_dir:
+        values = {
+            'STATUS_FILE': os.path.join(state_dir, 'status.json'),
+            'RECORDS_FILE': os.path.join(state_dir, 'records.json'),
+            'CLUSTER_NODE_ID': node_id,
+            'CLUSTER_PEERS': [('127.0.0.1', 9871 + i) for i in range(peers)],
+            'CLUSTER_SECRET': 'test-secret',
+            'CLUSTER_QUORUM': None,
+            'status_state': {'dirty': False, 'legacy': {}},
+            'cluster_state': {'peers': {}, 'results': {}, 'transport': None, 'last_status': {
+                'zone': {'www.example.com': {'original_ip': '10.0.0.1', 'ping_failures': 0, 'tcp_failures': 0, 'new_ip': None,
+                                             'is_restored': False, 'revert_state': 'idle', 'revert_successes': 0}},
+            }},
+            'record_index': {'zone': {'fetched_at': time.time(), 'etag': None, 'records': {
+                'record1': {'name': 'www.example.com', 'type': 'A', 'content': '10.0.0.1'},
+            }}},
+        }
+        original = {name: getattr(monitor, name) for name in values}
+        for name, value in values.items():
+            setattr(monitor, name, value)
+        try:
+            yield
+        finally:
+            for name, value in original.items():
+                setattr(monitor, name, value)
+
+
+def peer_message(node_id, healthy=None, overrides=None, ts=None):
+    payload = {'node': node_id, 'ts': time.time() if ts is None else ts, 'results': {}}
+    if healthy is not None:
+        payload['results'][f"{BACKEND[0]}:{BACKEND[1]}"] = [time.time(), healthy]
+    if overrides is not None:
+        payload['overrides'] = overrides
+    return monitor.encode_cluster_message(payload)
+
+
+def test_quorum():
+    with cluster_node():
+        monitor.record_cluster_results({BACKEND: {'ping': None, 'tcp': False}})
+        # فقط همین نود قطعی را دیده: یک رأی از سه، failover انجام نمی‌شود
+        assert not monitor.cluster_agrees(*BACKEND, False)
+        monitor.handle_cluster_message(peer_message('c', healthy=True), PEER_ADDRESS)
+        assert not monitor.cluster_agrees(*BACKEND, False)
+        monitor.handle_cluster_message(peer_message('a', healthy=False), PEER_ADDRESS)
+        assert monitor.cluster_votes(*BACKEND, False) == 2
+        assert monitor.cluster_agrees(*BACKEND, False)
+
+
+def test_bad_signature_and_stale_messages_are_ignored():
+    with cluster_node():
+        monitor.CLUSTER_SECRET = 'other-secret'
+        forged = peer_message('a', healthy=False)
+        monitor.CLUSTER_SECRET = 'test-secret'
+        monitor.handle_cluster_message(forged, PEER_ADDRESS)
+        monitor.handle_cluster_message(peer_message('c', healthy=False, ts=time.time() - 2 * monitor.CLUSTER_PEER_TIMEOUT), PEER_ADDRESS)
+        assert monitor.cluster_state['peers'] == {}
+
+
+def test_leader_selection():
+    with cluster_node('b'):
+        # تنها: کوچک‌ترین شناسه است ولی بدون quorum در کلودفلر نمی‌نویسد
+        assert monitor.cluster_leader() == 'b'
+        assert not monitor.is_cluster_leader()
+        monitor.handle_cluster_message(peer_message('c'), PEER_ADDRESS)
+        assert monitor.is_cluster_leader()
+        monitor.handle_cluster_message(peer_message('a'), PEER_ADDRESS)
+        assert monitor.cluster_leader() == 'a'
+        assert not monitor.is_cluster_leader()
+        # نودی که بیش از CLUSTER_PEER_TIMEOUT پیامی نفرستاده از انتخاب leader خارج می‌شود
+        monitor.cluster_state['peers']['a']['seen_at'] -= 2 * monitor.CLUSTER_PEER_TIMEOUT
+        assert monitor.is_cluster_leader()
+
+
+def test_sync_from_leader():
+    with cluster_node('b'):
+        subdomain_status = monitor.cluster_state['last_status']['zone']['www.example.com']
+        overrides = {'zone': {'www.example.com': '10.0.0.2'}}
+        # پیام c که leader نیست نادیده گرفته می‌شود
+        monitor.handle_cluster_message(peer_message('a'), PEER_ADDRESS)
+        monitor.handle_cluster_message(peer_message('c', overrides=overrides), PEER_ADDRESS)
+        assert subdomain_status['new_ip'] is None
+        monitor.handle_cluster_message(peer_message('a', overrides=overrides), PEER_ADDRESS)
+        assert subdomain_status['new_ip'] == '10.0.0.2'
+        assert subdomain_status['revert_state'] == 'waiting'
+        assert monitor.record_index['zone']['records']['record1']['content'] == '10.0.0.2'
+        assert os.path.exists(monitor.STATUS_FILE)
+        # leader آیپی اصلی را برگردانده است
+        monitor.handle_cluster_message(peer_message('a', overrides={'zone': {}}), PEER_ADDRESS)
+        assert subdomain_status['new_ip'] is None
+        assert monitor.record_index['zone']['records']['record1']['content'] == '10.0.0.1'
+
+
+def test_default_secret_is_refused():
+    with cluster_node():
+        monitor.CLUSTER_SECRET = monitor.DEFAULT_CLUSTER_SECRET
+        try:
+            asyncio.run(monitor.start_cluster(monitor.cluster_state['last_status']))
+        except SystemExit:
+            pass
+        else:
+            raise AssertionError("start_cluster accepted the default CLUSTER_SECRET")
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name}: ok")
@@ -0,0 +1,90 @@
+# بررسی تصمیم failover و برگشت در حالت single بدون شبکه و کلودفلر
+import asyncio
+import contextlib
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cloudflareAuto_change_ip as monitor
+
+UP = {'ping': 1.0, 'tcp': True, 'error': None}
+DOWN = {'ping': None, 'tcp': False, 'error': 'refused'}
+
+
+@contextlib.contextmanager
+def patched(**values):
+    original = {name: getattr(monitor, name) for name in values}
+    for name, value in values.items():
+        setattr(monitor, name, value)
+    try:
+        yield
+    finally:
+        for name, value in original.items():
+            setattr(monitor, name, value)
+
+
+def plan_round(health, changed_ago, suppressed=()):
+    # www روی آی‌پی اصلی A بود، changed_ago ثانیه پیش به B رفته و A در این دور به REVERT_SUCCESSES موفقیت می‌رسد
+    last_status = {'zone': {'www': {'original_ip': 'A', 'ping_failures': monitor.MAX_ATTEMPTS - 1, 'tcp_failures': 0, 'new_ip': 'B',
+                                    'is_restored': False, 'revert_state': 'verifying', 'revert_successes': monitor.REVERT_SUCCESSES - 1}}}
+    dns_plans = {'zone': {}}
+    status_summaries = {'zone': {}}
+
+    async def run():
+        monitor.cache_backend_health({(ip, 443): result for ip, result in health.items()})
+        await monitor.run_checks({'zone': {'www': 'B'}}, set(health), last_status, status_summaries, dns_plans)
+
+    with patched(ADDRESSES=[(443, 'A'), (443, 'B'), (443, 'C')], CLUSTER_NODE_ID=None, health_cache={}, backend_load=Counter(),
+                 flap_state={'penalties': {}, 'suppressed': set(suppressed), 'changed_at': {('zone', 'www'): time.time() - changed_ago}}):
+        asyncio.run(run())
+        return dns_plans['zone'], dict(monitor.backend_load), status_summaries['zone']
+
+
+def test_held_revert_keeps_failover_off_a_down_backend():
+    # A سالم است ولی hold time هنوز تمام نشده؛ B قطع است پس باید به C برود نه اینکه روی B بماند
+    plan, load, _ = plan_round({'A': UP, 'B': DOWN, 'C': UP}, changed_ago=60)
+    assert plan == {'www': 'C'}
+    assert load == {'B': 0, 'C': 1}
+
+
+def test_suppressed_original_keeps_failover():
+    plan, _, _ = plan_round({'A': UP, 'B': DOWN, 'C': UP}, changed_ago=2 * monitor.DNS_HOLD_TIME, suppressed={('A', 443)})
+    assert plan == {'www': 'C'}
+
+
+def test_allowed_revert_replaces_failover():
+    plan, load, _ = plan_round({'A': UP, 'B': DOWN, 'C': UP}, changed_ago=2 * monitor.DNS_HOLD_TIME)
+    assert plan == {'www': 'A'}
+    assert load == {'A': 1, 'B': 0, 'C': 0}
+
+
+def test_no_alternative_is_a_status_not_a_change():
+    # در قطعی کامل این خط از مسیر diff وضعیت‌ها می‌گذرد تا در هر دور دوباره به تلگرام نرود
+    plan, _, status = plan_round({'A': DOWN, 'B': DOWN, 'C': DOWN}, changed_ago=60)
+    assert plan == {}
+    assert status['www'][0] == 'no_alternative'
+
+
+def test_steady_round_does_not_dirty_status():
+    last_status = {}
+
+    async def run():
+        monitor.cache_backend_health({('A', 443): UP})
+        await monitor.check_subdomain_status('zone', 'www', 'A', last_status, {}, {})
+        assert monitor.status_state['dirty']  # ساب‌دامین جدید
+        monitor.status_state['dirty'] = False
+        await monitor.check_subdomain_status('zone', 'www', 'A', last_status, {}, {})
+
+    with patched(ADDRESSES=[(443, 'A')], health_cache={}, status_state={'dirty': False, 'legacy': {}}):
+        asyncio.run(run())
+        assert not monitor.status_state['dirty']
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name}: ok")
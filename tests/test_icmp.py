@@ -0,0 +1,92 @@
+# بررسی icmp_batch_ping روی loopback؛ با pytest یا مستقیم با python tests/test_icmp.py اجرا می‌شود
+import asyncio
+import os
+import socket
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cloudflareAuto_change_ip as monitor
+
+UNROUTABLE_IP = '198.51.100.1'  # TEST-NET-2 (RFC 5737): هیچ وقت جواب نمی‌دهد
+
+
+def icmp_permitted():
+    try:
+        sock, _ = monitor.open_icmp_socket()
+    except OSError:
+        return False
+    sock.close()
+    return True
+
+
+def test_loopback_reply():
+    if not icmp_permitted():
+        raise unittest.SkipTest("ICMP sockets are not permitted")
+    results = monitor.icmp_batch_ping(['127.0.0.1'], timeout=1)
+    assert results['127.0.0.1'] is not None and results['127.0.0.1'] < 1000
+
+
+def test_unroutable_timeout():
+    if not icmp_permitted():
+        raise unittest.SkipTest("ICMP sockets are not permitted")
+    started = time.monotonic()
+    results = monitor.icmp_batch_ping(['127.0.0.1', UNROUTABLE_IP], timeout=0.5)
+    # هر دو در یک پنجره زمانی: پاسخ loopback ثبت می‌شود و آدرس بی‌پاسخ بعد از timeout برابر None است
+    assert results['127.0.0.1'] is not None
+    assert results[UNROUTABLE_IP] is None
+    assert time.monotonic() - started < 1.5
+
+
+def test_tcp_fallback_without_icmp_permission():
+    def open_icmp_socket():
+        raise PermissionError("Operation not permitted")
+
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    port = listener.getsockname()[1]
+    original, original_method = monitor.open_icmp_socket, monitor.PING_METHOD
+    monitor.open_icmp_socket, monitor.PING_METHOD = open_icmp_socket, 'auto'
+    try:
+        results = asyncio.run(monitor.async_batch_ping([('127.0.0.1', port)]))
+    finally:
+        monitor.open_icmp_socket, monitor.PING_METHOD = original, original_method
+        listener.close()
+    assert results['127.0.0.1'] is not None
+
+
+def test_probe_concurrency_is_bounded():
+    # بررسی سرویس و fallback TCP هر دو از همان سقف PROBE_CONCURRENCY استفاده می‌کنند
+    active, peak = [0], [0]
+
+    async def open_connection(ip, port, **kwargs):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        await asyncio.sleep(0.02)
+        active[0] -= 1
+        raise ConnectionRefusedError(f"{ip}:{port}")
+
+    targets = [(f"10.0.0.{i}", 80) for i in range(12)]
+    original = (monitor.asyncio.open_connection, monitor.PROBE_CONCURRENCY, monitor.PING_METHOD, monitor.record_probe)
+    monitor.asyncio.open_connection, monitor.PROBE_CONCURRENCY, monitor.PING_METHOD = open_connection, 3, 'tcp'
+    monitor.record_probe = lambda *args: None
+    try:
+        results = asyncio.run(monitor.probe_backends(targets))
+    finally:
+        monitor.asyncio.open_connection, monitor.PROBE_CONCURRENCY, monitor.PING_METHOD, monitor.record_probe = original
+    assert peak[0] == 3
+    assert all(result['tcp'] is False for result in results.values())
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            try:
+                test()
+            except unittest.SkipTest as e:
+                print(f"{name}: skipped ({e})")
+            else:
+                print(f"{name}: ok")